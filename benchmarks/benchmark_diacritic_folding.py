@@ -0,0 +1,70 @@
+import os
+import sys
+import random
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dataset_processing_scripts'))
+
+from utils import uwb_diacritics
+from normalization import fold_diacritics
+
+RANDOM_SEED = 42
+NUM_TRANSCRIPTS = 20000
+REPEATS = 5
+
+CP1250_DIACRITICS = [
+    d for d in uwb_diacritics
+    if d.encode('cp1250', errors='ignore').decode('cp1250') == d
+]
+WORDS = [
+    'PRAHA', 'RADAR', 'CONTACT', 'DESCEND', 'LEVEL', 'ROGER', 'GOOD', 'DAY',
+    'LUFTHANSA', 'CLIMB', 'FL', 'SQUAWK', 'IDENT', '1', '2', '5', '9', 'OK',
+]
+
+
+def replace_loop(text):
+    for d, r in uwb_diacritics.items():
+        text = text.replace(d, r)
+    return text
+
+
+def synthetic_corpus(n):
+    rng = random.Random(RANDOM_SEED)
+    corpus = []
+    for _ in range(n):
+        words = []
+        for _ in range(rng.randint(4, 16)):
+            w = rng.choice(WORDS)
+            if rng.random() < 0.3:
+                i = rng.randrange(len(w) + 1)
+                w = w[:i] + rng.choice(CP1250_DIACRITICS) + w[i:]
+            words.append(w)
+        corpus.append(' '.join(words).encode('cp1250').decode('cp1250'))
+    return corpus
+
+
+def throughput(fn, corpus):
+    best = float('inf')
+    for _ in range(REPEATS):
+        t0 = time.perf_counter()
+        for line in corpus:
+            fn(line)
+        best = min(best, time.perf_counter() - t0)
+    return len(corpus) / best
+
+
+def main():
+    corpus = synthetic_corpus(NUM_TRANSCRIPTS)
+    mismatches = sum(replace_loop(t) != fold_diacritics(t) for t in corpus)
+    old = throughput(replace_loop, corpus)
+    new = throughput(fold_diacritics, corpus)
+    print(f'Transcripts: {len(corpus)} (cp1250, {len(CP1250_DIACRITICS)} distinct diacritics)')
+    print(f'str.replace loop: {old:,.0f} lines/sec')
+    print(f'str.translate:    {new:,.0f} lines/sec')
+    print(f'Speedup: {new / old:.1f}x, mismatches: {mismatches}')
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
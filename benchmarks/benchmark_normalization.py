@@ -0,0 +1,230 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dataset_processing_scripts'))
+
+from utils import (
+    uwb_general_corrections,
+    uwb_diacritics,
+    uwb_phonetic_mapping,
+    uwb_number_mapping,
+    uwb_exclude_if_contains,
+    atc_0_general_corrections,
+    atco2_general_corrections,
+)
+from normalization import fold_diacritics
+import uwb_text as uwb
+import atcc_text as atcc
+import atco2_text as atco2
+
+RANDOM_SEED = 42
+DEFAULT_LINES = 5000
+REPEATS = 3
+
+COMMON_WORDS = [
+    'CONTACT', 'TOWER', 'ROGER', 'DESCEND', 'CLIMB', 'LEVEL', 'HEADING', 'RUNWAY',
+    'CLEARED', 'APPROACH', 'SQUAWK', 'PRAHA', 'RADAR', 'LUFTHANSA', 'GOOD', 'DAY',
+    'MAINTAIN', 'DIRECT', 'WILCO', 'REPORT', 'THANK', 'YOU',
+]
+
+
+def synthetic_uwb(rng, n):
+    tags = ['[air]', '[ground]', '[speaker]', '[noise_|]', '[|_noise]', '[ehm_??]']
+    misspellings = list(uwb_general_corrections)
+    diacritics = [d for d in uwb_diacritics if d.encode('cp1250', errors='ignore')]
+    letters = list(uwb_phonetic_mapping)
+    numbers = [k for k in uwb_number_mapping if k != '.']
+    excluded = [p for p in uwb_exclude_if_contains if p.isalpha()]
+    lines = []
+    for _ in range(n):
+        words = [rng.choice(tags)]
+        for _ in range(rng.randint(4, 14)):
+            r = rng.random()
+            if r < 0.25:
+                words.append(rng.choice(numbers))
+            elif r < 0.35:
+                words.append(rng.choice(letters))
+            elif r < 0.45:
+                words.append(rng.choice(misspellings).lower())
+            elif r < 0.5:
+                words.append('FL')
+            else:
+                words.append(rng.choice(COMMON_WORDS).lower())
+        if rng.random() < 0.3:
+            i = rng.randrange(len(words))
+            words[i] += rng.choice(diacritics)
+        if rng.random() < 0.05:
+            words.append(rng.choice(excluded))
+        if rng.random() < 0.05:
+            words.append(rng.choice(['[czech_|]', '(Vienna(vin))', 't+']))
+        if rng.random() < 0.3:
+            words.append(rng.choice(tags))
+        lines.append(' '.join(words))
+    return lines
+
+
+def synthetic_atcc(rng, n):
+    misspellings = list(atc_0_general_corrections)
+    extras = ['(LONG PAUSE)', '(BREAK)', 'TH- THE', "I 'M", "O 'CLOCK", '(QUOTE ROGER)', '/']
+    lines = []
+    for _ in range(n):
+        words = []
+        for _ in range(rng.randint(4, 14)):
+            r = rng.random()
+            if r < 0.15:
+                words.append(rng.choice(misspellings))
+            elif r < 0.25:
+                words.append(rng.choice(extras))
+            else:
+                words.append(rng.choice(COMMON_WORDS))
+        if rng.random() < 0.03:
+            words.append('(UNINTELLIGIBLE)')
+        if rng.random() < 0.03:
+            words.append('7')
+        lines.append(' '.join(words))
+    return lines
+
+
+def synthetic_atco2(rng, n):
+    misspellings = list(atco2_general_corrections)
+    lines = []
+    for _ in range(n):
+        words = []
+        for _ in range(rng.randint(4, 14)):
+            r = rng.random()
+            if r < 0.15:
+                words.append(rng.choice(misspellings).lower())
+            elif r < 0.25:
+                words.append(f'[#callsign]{rng.choice(COMMON_WORDS).lower()}[/#callsign]')
+            elif r < 0.3:
+                words.append(rng.choice(['[hes]', '[noise]', '[#value]']))
+            else:
+                words.append(rng.choice(COMMON_WORDS).lower())
+        if rng.random() < 0.05:
+            words.append(rng.choice(['[NE Czech]', '[spk]', '(', ')']))
+        lines.append(' '.join(words))
+    return lines
+
+
+def uwb_stages(lines):
+    folded = [fold_diacritics(t) for t in lines]
+    kept = [t for t in folded if not uwb.find_exclusion(t)]
+    untagged = [uwb.remove_tags(t) for t in kept]
+    lettered = [
+        re.sub(r'(?<=\s)([b-hj-zB-HJ-Z])(?=\s)', uwb.replace_phonetic, f' {t} ').strip()
+        for t in untagged
+    ]
+    corrected = [uwb.UWB_CORRECTIONS(t) for t in lettered]
+    return [
+        ('diacritics', fold_diacritics, lines),
+        ('exclusion', uwb.find_exclusion, folded),
+        ('tag_removal', uwb.remove_tags, kept),
+        ('corrections', uwb.UWB_CORRECTIONS, lettered),
+        ('phonetic_expansion', uwb.expand_tokens, corrected),
+        ('full', uwb.normalize_text, lines),
+    ]
+
+
+def atcc_stages(lines):
+    cleaner = atcc.AtccTextCleaner()
+    kept = [t for t in lines if not cleaner.rejection_reason(t)]
+    untagged = [cleaner.remove_tags(t) for t in kept]
+    return [
+        ('exclusion', cleaner.rejection_reason, lines),
+        ('tag_removal', cleaner.remove_tags, kept),
+        ('corrections', cleaner.corrections, untagged),
+        ('full', cleaner._clean, lines),
+    ]
+
+
+def atco2_stages(lines):
+    kept = [t for t in lines if not atco2.COMPILED_EXCLUSION.search(t)]
+    untagged = [atco2.remove_tags(t) for t in kept]
+    return [
+        ('exclusion', atco2.COMPILED_EXCLUSION.search, lines),
+        ('tag_removal', atco2.remove_tags, kept),
+        ('corrections', atco2.ATCO2_CORRECTIONS, untagged),
+        ('full', atco2.normalize_transcript, lines),
+    ]
+
+
+CORPORA = {
+    'uwb': (synthetic_uwb, uwb_stages, uwb_general_corrections),
+    'atcc': (synthetic_atcc, atcc_stages, atc_0_general_corrections),
+    'atco2': (synthetic_atco2, atco2_stages, atco2_general_corrections),
+}
+
+
+def time_stage(fn, lines):
+    best = float('inf')
+    for _ in range(REPEATS):
+        t0 = time.perf_counter()
+        for t in lines:
+            fn(t)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def per_rule_costs(corrections, lines, top):
+    # Cost of each correction as a standalone word-bounded regex over the
+    # corpus; newly added entries with unusually expensive patterns show up
+    # here even when they hardly move the stage total.
+    costs = []
+    for wrong in corrections:
+        rx = re.compile(rf'\b{re.escape(wrong)}\b', re.IGNORECASE)
+        t0 = time.perf_counter()
+        for t in lines:
+            rx.search(t)
+        costs.append((time.perf_counter() - t0, wrong))
+    costs.sort(reverse=True)
+    return [{'rule': w, 'seconds': round(s, 6)} for s, w in costs[:top]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-stage benchmark of the transcript normalizers.')
+    parser.add_argument('--lines', type=int, default=DEFAULT_LINES)
+    parser.add_argument('--corpus', choices=sorted(CORPORA), action='append')
+    parser.add_argument('--per-rule', type=int, default=0, metavar='N',
+                        help='Also report the N most expensive correction rules per corpus.')
+    parser.add_argument('--output', help='Write machine-readable results to this JSON file.')
+    args = parser.parse_args()
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'seed': RANDOM_SEED,
+        'lines': args.lines,
+        'corpora': {},
+    }
+    for name in args.corpus or sorted(CORPORA):
+        generate, stages, corrections = CORPORA[name]
+        lines = generate(random.Random(RANDOM_SEED), args.lines)
+        corpus_result = {'rule_count': len(corrections), 'stages': {}}
+        for stage, fn, stage_lines in stages(lines):
+            seconds = time_stage(fn, stage_lines)
+            rate = len(stage_lines) / seconds if seconds else float('inf')
+            corpus_result['stages'][stage] = {
+                'lines': len(stage_lines),
+                'seconds': round(seconds, 6),
+                'lines_per_sec': round(rate, 1),
+            }
+            print(f'{name:6} {stage:20} {len(stage_lines):7d} lines {rate:12,.0f} lines/sec')
+        if args.per_rule:
+            corpus_result['costliest_rules'] = per_rule_costs(corrections, lines, args.per_rule)
+            for r in corpus_result['costliest_rules']:
+                print(f'{name:6}   rule {r["rule"]!r}: {r["seconds"] * 1000:.2f} ms')
+        results['corpora'][name] = corpus_result
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dataset_processing_scripts'))
+
+from uwb_text import convert_atc_text
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'uwb_convert_atc_text_golden.jsonl')
+REPEATS = 5
+
+
+def load_golden(path=GOLDEN_PATH):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def check_golden(records):
+    failures = []
+    for r in records:
+        got = convert_atc_text(r['input'])
+        if got != r['output']:
+            failures.append((r['input'], r['output'], got))
+    return failures
+
+
+def tokens_per_sec(inputs):
+    num_tokens = sum(len(t.split()) for t in inputs)
+    best = float('inf')
+    for _ in range(REPEATS):
+        t0 = time.perf_counter()
+        for t in inputs:
+            convert_atc_text(t)
+        best = min(best, time.perf_counter() - t0)
+    return num_tokens / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check and benchmark UWB phonetic/number expansion.')
+    parser.add_argument('--update-golden', action='store_true',
+                        help='Rewrite the golden outputs from the current convert_atc_text.')
+    args = parser.parse_args()
+    records = load_golden()
+    if args.update_golden:
+        with open(GOLDEN_PATH, 'w', encoding='utf-8') as f:
+            for r in records:
+                r = {'input': r['input'], 'output': convert_atc_text(r['input'])}
+                f.write(json.dumps(r, ensure_ascii=False) + '\n')
+        print(f'Updated {len(records)} golden outputs.')
+        return
+    failures = check_golden(records)
+    for inp, expected, got in failures[:10]:
+        print(f'MISMATCH {inp!r}\n  expected: {expected}\n  got:      {got}')
+    print(f'Golden: {len(records) - len(failures)}/{len(records)} match')
+    print(f'convert_atc_text: {tokens_per_sec([r["input"] for r in records]):,.0f} tokens/sec')
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
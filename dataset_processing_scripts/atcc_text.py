@@ -0,0 +1,116 @@
+import re
+from utils import atc_0_general_corrections
+from normalization import CorrectionEngine, NormalizationCache, rules_version
+
+
+def clean_whitespace(s):
+    return ' '.join(s.split())
+
+
+TAGS_OMIT = [
+    '(UNINTELLIGIBLE)',
+    'UNINTELLIGIBLE',
+    '(MIC KEYED TWICE)',
+    '(CARRIER TRANSMITTED ONLY)',
+]
+
+TAGS_REMOVE = [
+    'LONG PAUSE',
+    'SHORT PAUSE',
+    'BREAK',
+    'GARBLED',
+    'LAUGHTER',
+    '/',
+    '//',
+]
+
+OMIT_REGEX = [
+    re.compile(r'\(?'+t.replace(' ', '[-\\s]')+r'\)?', re.IGNORECASE) for t in TAGS_REMOVE
+]
+STUTTER_RE = re.compile(r'\b\w+-\s+(\w+)\b', re.IGNORECASE)
+QUOTE_RE = re.compile(r'\(QUOTE\s+([A-Z]+)\)', re.IGNORECASE)
+PLAIN_QUOTE = re.compile(r'\bQUOTE\s+([A-Z]+)\b', re.IGNORECASE)
+CONTRACTION_RE = re.compile(
+    r"\b([A-Z]+)\s+'\s*(RE|LL|VE|D|S|M|T|AM)\b", re.IGNORECASE
+)
+OCLOCK_RE = re.compile(r"\b(O)\s+'\s*(CLOCK)\b", re.IGNORECASE)
+
+
+def fix_quotes(line):
+    line = QUOTE_RE.sub(lambda m: f"'{m.group(1)}", line)
+
+    def repl(m):
+        return f"'{m.group(1)}" if m.start() == 0 or line[m.start() - 1].isspace() else m.group(0)
+
+    return PLAIN_QUOTE.sub(repl, line)
+
+
+class AtccTextCleaner:
+    OMIT_TAG = 'omit_tag'
+    DIGIT_OR_BRACKET = 'digit_or_bracket'
+    EMPTY = 'empty'
+    DOUBLE_QUOTE = 'double_quote'
+
+    def __init__(self, corrections=atc_0_general_corrections):
+        self.omit_tags = re.compile('|'.join(re.escape(t) for t in TAGS_OMIT))
+        self.digit_or_bracket = re.compile(r'[\d\[\]]')
+        self.any_remove_tag = re.compile(
+            '|'.join(rx.pattern for rx in OMIT_REGEX), re.IGNORECASE
+        )
+        self.trailing_dash = re.compile(r'\s*-\s*$')
+        self.corrections = CorrectionEngine(corrections)
+        self.cache = NormalizationCache(
+            'atcc_text', rules_version(corrections, TAGS_OMIT, TAGS_REMOVE)
+        )
+
+    def clean(self, raw_text):
+        return self.cache.get_or_compute(raw_text, self._clean)
+
+    def _clean(self, raw_text):
+        reason = self.rejection_reason(raw_text)
+        if reason:
+            return None, reason
+        txt = clean_whitespace(self.corrections(self.remove_tags(raw_text)))
+        if not txt:
+            return None, self.EMPTY
+        if '"' in txt:
+            return None, self.DOUBLE_QUOTE
+        return txt, None
+
+    def rejection_reason(self, raw_text):
+        if self.omit_tags.search(raw_text):
+            return self.OMIT_TAG
+        if self.digit_or_bracket.search(raw_text):
+            return self.DIGIT_OR_BRACKET
+        return None
+
+    def remove_tags(self, raw_text):
+        txt = raw_text.replace(';', '').replace('`', "'")
+        if self.any_remove_tag.search(txt):
+            for rx in OMIT_REGEX:
+                txt = rx.sub('', txt)
+        txt = txt.replace('(', ' ').replace(')', ' ')
+        if 'QUOTE' in txt:
+            txt = fix_quotes(txt)
+        if '-' in txt:
+            txt = STUTTER_RE.sub(r'\1', txt)
+            txt = self.trailing_dash.sub('', txt)
+        if "'" in txt:
+            txt = CONTRACTION_RE.sub(r"\1'\2", txt)
+            txt = OCLOCK_RE.sub(r"\1'\2", txt)
+        return txt
+
+    def clean_batch(self, raw_texts):
+        cleaned, reasons = [], []
+        for raw in raw_texts:
+            txt, reason = self.clean(raw)
+            cleaned.append(txt)
+            reasons.append(reason)
+        return cleaned, reasons
+
+
+ATCC_TEXT_CLEANER = AtccTextCleaner()
+
+
+def normalize_transmission(raw):
+    return ATCC_TEXT_CLEANER.clean(clean_whitespace(raw))
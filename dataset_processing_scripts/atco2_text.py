@@ -0,0 +1,52 @@
+import re
+from utils import atco2_general_corrections
+from normalization import CorrectionEngine, NormalizationCache, rules_version
+
+TAGS_REMOVE = [
+    r'\[#command\]', r'\[/#command\]', r'\[#value\]', r'\[/#value\]',
+    r'\[#unnamed\]', r'\[/#unnamed\]', r'\[#callsign\]', r'\[/#callsign\]',
+    r'\[hes\]', r'\[HES\]', r'\[noise\]',
+]
+
+EXCLUDE_IF_CONTAINS = [
+    r'\[NE Czech\]', r'\[/NE\]', r'\[NE Slovak\]', r'\[Ne Czech\]',
+    r'\[/Ne\]', r'\[Ne Slovak\]', r'\[#nonenglish\]', r'\[/#nonenglish\]',
+    r'\[ukn\]', r'\[spk\]', r'\[xt\]', r'[\(\)]',
+]
+
+COMPILED_TAGS_REMOVE = [re.compile(p, re.IGNORECASE) for p in TAGS_REMOVE]
+COMPILED_EXCLUSION = re.compile('|'.join(EXCLUDE_IF_CONTAINS), re.IGNORECASE)
+ATCO2_CORRECTIONS = CorrectionEngine(atco2_general_corrections)
+ATCO2_TEXT_CACHE = NormalizationCache(
+    'atco2_transcript',
+    rules_version(atco2_general_corrections, TAGS_REMOVE, EXCLUDE_IF_CONTAINS),
+)
+
+
+def clean_transcript(text):
+    return ATCO2_TEXT_CACHE.get_or_compute(text, normalize_transcript)
+
+
+def remove_tags(text):
+    if '[' in text:
+        for p in COMPILED_TAGS_REMOVE:
+            text = p.sub('', text)
+    return text
+
+
+def normalize_transcript(text):
+    if COMPILED_EXCLUSION.search(text):
+        return None
+    text = ATCO2_CORRECTIONS(remove_tags(text))
+    cleaned = re.sub(r'\s{2,}', ' ', text.strip()).upper()
+    return cleaned or None
+
+
+def normalize_transmission(raw):
+    raw = raw.strip()
+    if not raw:
+        return None, 'empty'
+    cleaned = clean_transcript(raw)
+    if not cleaned:
+        return None, 'excluded'
+    return cleaned, None
@@ -1,53 +1,182 @@
+import io
 import os
-import sys
+import struct
 import shutil
+import functools
+import argparse
 import soundfile as sf
 import resampy
 import numpy as np
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import Counter
 from tqdm import tqdm
+from executors import add_executor_arguments, make_executor
+from materialize import MANIFEST_NAME, MATERIALIZE_MODES, write_manifest
+from output_sink import (
+    add_sink_arguments,
+    bind_sink,
+    clear_markers,
+    is_sharded,
+    is_virtual,
+    iter_samples,
+    open_sink,
+    remove_shards,
+    replay_calls,
+)
+from pipeline import Pipeline, Stage, add_pipeline_arguments, stage_workers
+from wav_memmap import WAVE_FORMAT_PCM, parse_wav_header
 
 TARGET_SR = 16000
+DEFAULT_MATERIALIZE = 'reflink'
+ENTRY_CHUNK_SIZE = 16
 DEFAULT_DATASETS = ['ATCC_Dataset', 'ATCO2_Dataset', 'UWB_Dataset']
 DESTINATION = 'ATC_ASR_Dataset'
 DEST_AUDIO_DIR = os.path.join(DESTINATION, 'audios')
-DEST_TEXT_DIR = os.path.join(DESTINATION, 'texts')
-
-os.makedirs(DEST_AUDIO_DIR, exist_ok=True)
-os.makedirs(DEST_TEXT_DIR, exist_ok=True)
-
-datasets = sys.argv[1:] if len(sys.argv) > 1 else DEFAULT_DATASETS
-pairs = []
-
-for ds in datasets:
-    audio_dir = os.path.join(ds, 'audios')
-    text_dir = os.path.join(ds, 'texts')
-    if not (os.path.isdir(audio_dir) and os.path.isdir(text_dir)):
-        print(f'Skipping missing dataset: {ds}')
-        continue
-    audios = {os.path.splitext(f)[0]: os.path.join(audio_dir, f)
-              for f in os.listdir(audio_dir) if f.endswith('.wav')}
-    texts = {os.path.splitext(f)[0]: os.path.join(text_dir, f)
-             for f in os.listdir(text_dir) if f.endswith('.txt')}
-    for key in set(audios) & set(texts):
-        pairs.append((key, audios[key], texts[key]))
-
-def process_entry(key, audio_path, text_path):
+
+def dataset_exists(ds):
+    return is_sharded(ds) or is_virtual(ds) or (os.path.isdir(os.path.join(ds, 'audios'))
+                                                and os.path.isdir(os.path.join(ds, 'texts')))
+
+def iter_all_samples(datasets):
+    for ds in datasets:
+        if not dataset_exists(ds):
+            print(f'Skipping missing dataset: {ds}')
+            continue
+        yield from iter_samples(ds)
+
+def is_target_format(f):
+    try:
+        sr, channels, bits, format_tag, _, _ = parse_wav_header(f)
+    except (OSError, ValueError, struct.error):
+        return False
+    return (sr, channels, bits, format_tag) == (TARGET_SR, 1, 16, WAVE_FORMAT_PCM)
+
+def audio_source(sample):
+    if sample.audio_path is not None:
+        return open(sample.audio_path, 'rb')
+    return io.BytesIO(sample.audio_bytes)
+
+def manifest_record(sample, audio_path):
+    text = sample.text
+    if text is None:
+        with open(sample.text_path, encoding='utf-8') as f:
+            text = f.read()
+    return {'id': sample.uid, 'audio': os.path.abspath(audio_path), 'text': text.strip()}
+
+def process_entry(sample, manifest_only, sink):
+    # Clips that are already 16 kHz mono 16-bit PCM are placed as-is; only
+    # the rest are decoded, downmixed, resampled and re-encoded.
     try:
-        audio, sr = sf.read(audio_path)
+        key = sample.uid
+        if not manifest_only and not sink.claim(key):
+            return 'skipped', None
+        dest_audio = os.path.join(DEST_AUDIO_DIR, f'{key}.wav')
+        with audio_source(sample) as f:
+            fast = is_target_format(f)
+        if fast:
+            if not manifest_only:
+                sink.write(key, text=sample.text, text_path=sample.text_path,
+                           audio_path=sample.audio_path, audio_bytes=sample.audio_bytes)
+                return 'fast', None
+            if sample.audio_path is not None:
+                return 'fast', manifest_record(sample, sample.audio_path)
+            with open(dest_audio, 'wb') as f:
+                f.write(sample.audio_bytes)
+            return 'fast', manifest_record(sample, dest_audio)
+        with audio_source(sample) as f:
+            audio, sr = sf.read(f)
         if audio.ndim > 1:
             audio = np.mean(audio, axis=1)
         if sr != TARGET_SR:
             audio = resampy.resample(audio, sr, TARGET_SR)
         audio = np.clip(audio, -1.0, 1.0)
-        sf.write(os.path.join(DEST_AUDIO_DIR, f'{key}.wav'), audio, TARGET_SR, subtype='PCM_16')
-        shutil.copy2(text_path, os.path.join(DEST_TEXT_DIR, f'{key}.txt'))
+        if manifest_only:
+            sf.write(dest_audio, audio, TARGET_SR, subtype='PCM_16')
+            return 'slow', manifest_record(sample, dest_audio)
+        sink.write(key, text=sample.text, text_path=sample.text_path,
+                   samples=audio, sample_rate=TARGET_SR)
+        return 'slow', None
     except Exception:
-        pass
+        return 'failed', None
+
+def convert_entry(task, item):
+    return task(*item)
+
+def main():
+    parser = argparse.ArgumentParser(description='Combine processed datasets into ATC_ASR_Dataset.')
+    parser.add_argument('datasets', nargs='*', default=DEFAULT_DATASETS)
+    parser.add_argument('--materialize', choices=MATERIALIZE_MODES, default=DEFAULT_MATERIALIZE,
+                        help='How clips that need no transcoding, and transcripts, are placed.')
+    parser.add_argument('--manifest-only', action='store_true',
+                        help=f'Write only {MANIFEST_NAME} pointing at the source clips; '
+                             'clips that need transcoding, or that come from tar shards or '
+                             'virtual datasets, are still written to audios/.')
+    add_sink_arguments(parser)
+    add_executor_arguments(parser, default_chunk_size=ENTRY_CHUNK_SIZE)
+    add_pipeline_arguments(parser)
+    args = parser.parse_args()
+    if args.manifest_only and args.output_format != 'dir':
+        parser.error('--manifest-only cannot be combined with --output-format tar')
+
+    if args.manifest_only:
+        os.makedirs(DEST_AUDIO_DIR, exist_ok=True)
+        # The split step prefers shards or a texts/ folder over the manifest,
+        # so drop whatever an earlier tar or dir combine left behind.
+        clear_markers(DESTINATION)
+        remove_shards(DESTINATION)
+        shutil.rmtree(os.path.join(DESTINATION, 'texts'), ignore_errors=True)
+        sink = None
+    else:
+        sink = open_sink(DESTINATION, args.output_format, args.materialize, args.shard_size_mb << 20,
+                         prune=args.prune)
+        if os.path.exists(os.path.join(DESTINATION, MANIFEST_NAME)):
+            os.remove(os.path.join(DESTINATION, MANIFEST_NAME))
+
+    # Samples from tar shards are held in memory; the pipeline's bounded
+    # queues keep only a fixed number of them alive at once.
+    paths = Counter()
+    records = []
+    progress = tqdm(desc='Creating ATC_ASR_Dataset')
+    executor = make_executor('process', args.workers) if args.backend == 'process' else None
+    task = bind_sink(process_entry, sink, args.backend)
+
+    def collect(result):
+        (path, record), calls = result
+        replay_calls(sink, calls)
+        paths[path] += 1
+        if record:
+            records.append(record)
+        progress.update()
+
+    pipeline = Pipeline(
+        [
+            Stage('convert', functools.partial(convert_entry, task), stage_workers(args, 'convert', args.workers),
+                  executor=executor, batch_size=args.chunk_size),
+            Stage('write', collect),
+        ],
+        args.queue_size,
+        inline=args.backend == 'serial',
+    )
+    try:
+        pipeline.run((sample, args.manifest_only) for sample in iter_all_samples(args.datasets))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    progress.close()
+    if sink is not None:
+        # Samples of a missing dataset or a failed entry were never claimed.
+        if paths['failed'] or not all(dataset_exists(ds) for ds in args.datasets):
+            sink.prune = False
+        sink.close()
+
+    if args.manifest_only:
+        records.sort(key=lambda r: r['id'])
+        write_manifest(os.path.join(DESTINATION, MANIFEST_NAME), records)
+        print(f'Wrote {len(records)} entries to {os.path.join(DESTINATION, MANIFEST_NAME)}')
 
-with ThreadPoolExecutor() as ex:
-    futures = [ex.submit(process_entry, k, a, t) for k, a, t in pairs]
-    for _ in tqdm(as_completed(futures), total=len(futures), desc='Creating ATC_ASR_Dataset'):
-        pass
+    print(f'Pipeline: {pipeline.stats()}')
+    print(f"Fast path: {paths['fast']}, slow path: {paths['slow']}, failed: {paths['failed']}, "
+          f"already on disk: {paths['skipped']}")
+    print('ATC_ASR_Dataset processing completed.')
 
-print('ATC_ASR_Dataset processing completed.')
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+import os
+import random
+import multiprocessing
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+BACKENDS = ('thread', 'process', 'serial')
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+_reporters = {}
+
+
+class SerialExecutor:
+    # Runs each task inline at submit time; for debugging and profiling.
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+
+def add_executor_arguments(parser, default_backend='thread', default_workers=DEFAULT_WORKERS, default_chunk_size=1):
+    parser.add_argument('--backend', choices=BACKENDS, default=default_backend,
+                        help='thread: one process, GIL-bound; process: one interpreter per worker; '
+                             'serial: everything inline.')
+    parser.add_argument('--workers', type=int, default=default_workers)
+    parser.add_argument('--chunk-size', type=int, default=default_chunk_size,
+                        help='Tasks handed to a worker per submission.')
+
+
+def process_context():
+    # Pool workers start lazily, at the first submit, which may come from a
+    # pipeline stage thread while other threads hold locks; a child forked
+    # then can deadlock. Workers are started from a clean server process
+    # instead, or spawned where there is none.
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def make_executor(backend, workers, initializer=None, initargs=()):
+    # The initializer only runs for the process backend: threads and the
+    # serial backend share the parent's already-loaded state.
+    if backend == 'serial':
+        return SerialExecutor()
+    if backend == 'process':
+        return ProcessPoolExecutor(max_workers=workers, mp_context=process_context(),
+                                   initializer=initializer, initargs=initargs)
+    if backend == 'thread':
+        return ThreadPoolExecutor(max_workers=workers)
+    raise ValueError(f'unknown backend {backend!r}')
+
+
+def seed_task(seed, index):
+    # Seeds the global generators from the run's base seed and the task's
+    # position, so a task draws the same values whichever worker or backend
+    # runs it.
+    random.seed(f'{seed}-{index}')
+    import numpy as np
+    np.random.seed((seed * 1000003 + index) % (1 << 32))
+
+
+def add_worker_reporter(name, collect, merge):
+    # collect() runs in a worker process after each chunk and returns what
+    # changed there since its last call; the parent passes that to merge().
+    # This is how per-process state such as caches and counters gets back.
+    _reporters[name] = (collect, merge)
+
+
+def run_chunk(fn, chunk, report=False):
+    results = [fn(*args) for args in chunk]
+    if not report:
+        return results, None
+    return results, {name: collect() for name, (collect, _) in _reporters.items()}
+
+
+def submit_chunk(executor, fn, chunk):
+    return executor.submit(run_chunk, fn, chunk, isinstance(executor, ProcessPoolExecutor))
+
+
+def chunk_results(future):
+    results, reports = future.result()
+    for name, report in (reports or {}).items():
+        _reporters[name][1](report)
+    return results
+
+
+def imap_chunked(executor, fn, tasks, chunk_size=1, max_in_flight=None, ordered=False):
+    # Submits fn(*args) for every args tuple in tasks, chunk_size at a time,
+    # with at most max_in_flight chunks outstanding (default: four per
+    # worker; the serial executor counts as one). Yields results as chunks
+    # complete, or in task order with ordered.
+    if max_in_flight is None:
+        max_in_flight = 4 * getattr(executor, '_max_workers', 1)
+    pending = deque()
+    chunk = []
+
+    def completed(limit):
+        nonlocal pending
+        results = deque()
+        while len(pending) > limit:
+            if ordered:
+                results.extend(chunk_results(pending.popleft()))
+                continue
+            done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+            pending = deque(f for f in pending if f in not_done)
+            for future in done:
+                results.extend(chunk_results(future))
+        return results
+
+    for args in tasks:
+        chunk.append(args)
+        if len(chunk) >= chunk_size:
+            pending.append(submit_chunk(executor, fn, chunk))
+            chunk = []
+            yield from completed(max_in_flight - 1)
+    if chunk:
+        pending.append(submit_chunk(executor, fn, chunk))
+    yield from completed(0)
@@ -0,0 +1,65 @@
+import os
+import json
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+FICLONE = 0x40049409
+MATERIALIZE_MODES = ('copy', 'hardlink', 'symlink', 'reflink')
+MANIFEST_NAME = 'manifest.jsonl'
+
+
+def reflink(src, dst):
+    if fcntl is None:
+        raise OSError('reflink is not supported on this platform')
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def materialize(src, dst, mode='copy'):
+    # Places src at dst without decoding it. Links fall back to a plain copy
+    # when the filesystem refuses them (different device, no CoW or symlink
+    # support); returns the mode that was actually used.
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if mode == 'hardlink':
+        try:
+            os.link(src, dst)
+            return mode
+        except OSError:
+            pass
+    elif mode == 'symlink':
+        try:
+            os.symlink(os.path.abspath(src), dst)
+            return mode
+        except OSError:
+            pass
+    elif mode == 'reflink':
+        try:
+            reflink(src, dst)
+            return mode
+        except OSError:
+            if os.path.lexists(dst):
+                os.remove(dst)
+    elif mode != 'copy':
+        raise ValueError(f'unknown materialize mode {mode!r}')
+    shutil.copyfile(src, dst)
+    return 'copy'
+
+
+def write_manifest(path, records):
+    # records: dicts with at least 'id', 'audio' (path to the clip) and
+    # 'text' (the transcript itself).
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for r in records:
+            f.write(json.dumps(r, ensure_ascii=False) + '\n')
+    os.replace(tmp_path, path)
+
+
+def read_manifest(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,303 @@
+import os
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from executors import add_worker_reporter
+from utils import uwb_diacritics
+
+NORMALIZATION_VERSION = 1
+CACHE_DIR = '.normalization_cache'
+CACHE_MAXSIZE = 200000
+PERSIST_CACHES = False
+
+TOKEN_RE = re.compile(r'\w+|\S')
+DIACRITICS_TABLE = str.maketrans(uwb_diacritics)
+
+
+def rules_version(*tables):
+    payload = json.dumps([NORMALIZATION_VERSION, *tables], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def load_or_build_artifact(name, version, build):
+    path = os.path.join(CACHE_DIR, f'{name}-{version}.json')
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+    data = build()
+    write_json_atomic(path, data)
+    return data
+
+
+def write_json_atomic(path, data):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def fold_diacritics(text, table=DIACRITICS_TABLE):
+    return text.translate(table)
+
+
+def _tokens(s):
+    return [t.upper() for t in TOKEN_RE.findall(s)]
+
+
+def _contains(haystack, needle, proper=False):
+    n = len(needle)
+    if not n or n > len(haystack):
+        return False
+    start = 1 if proper else 0
+    for i in range(start, len(haystack) - n + 1):
+        if haystack[i:i + n] == needle:
+            return True
+    return False
+
+
+def _edge_overlap(a, b):
+    # True if a proper suffix of a equals a proper prefix of b.
+    for n in range(1, min(len(a), len(b))):
+        if a[-n:] == b[:n]:
+            return True
+    return False
+
+
+def _is_word_edged(s):
+    return bool(s) and bool(re.match(r'\w', s[0])) and bool(re.match(r'\w', s[-1]))
+
+
+class CorrectionEngine:
+    # Applies an ordered {wrong: right} table with the same result as running
+    # re.sub(rf'\b{re.escape(wrong)}\b', right, text) once per key in order,
+    # but compiled into as few combined alternations as the table allows.
+    # Keys that could interact with an earlier key (overlapping matches or a
+    # replacement that only partially matches a later key) start a new pass;
+    # replacements that a later key would rewrite wholesale are folded in at
+    # build time, so e.g. GOOD BYE -> GOODBYE -> GOOD BYE resolves up front.
+
+    def __init__(self, corrections, flags=re.IGNORECASE):
+        self.flags = flags
+        self.passes = []
+        group = []
+        for wrong, right in corrections.items():
+            if group and self._conflicts(group, wrong, right):
+                self.passes.append(self._compile(group))
+                group = []
+            group.append((wrong, right))
+        if group:
+            self.passes.append(self._compile(group))
+
+    def _key(self, s):
+        return s.upper() if self.flags & re.IGNORECASE else s
+
+    def _chain(self, right, later):
+        forms = [right]
+        for wrong, value in later:
+            nxt = re.sub(rf'\b{re.escape(wrong)}\b', value, forms[-1], flags=self.flags)
+            if nxt != forms[-1]:
+                forms.append(nxt)
+        return forms
+
+    def _conflicts(self, group, wrong, right):
+        new = _tokens(wrong)
+        if not _is_word_edged(wrong):
+            return True
+        for i, (prev_wrong, prev_right) in enumerate(group):
+            old = _tokens(prev_wrong)
+            if _edge_overlap(new, old) or _contains(new, old, proper=True):
+                return True
+            if not _is_word_edged(prev_right):
+                return True
+            for form in self._chain(prev_right, group[i + 1:] + [(wrong, right)]):
+                val = _tokens(form)
+                if _edge_overlap(val, new) or _edge_overlap(new, val):
+                    return True
+                if len(new) > len(val) and _contains(new, val):
+                    return True
+        return False
+
+    def _compile(self, group):
+        table = {}
+        for i, (wrong, right) in enumerate(group):
+            table.setdefault(self._key(wrong), self._chain(right, group[i + 1:])[-1])
+        pattern = re.compile(
+            r'\b(?:' + '|'.join(re.escape(w) for w, _ in group) + r')\b',
+            self.flags,
+        )
+        return pattern, table
+
+    def _lookup(self, table, matched):
+        value = table.get(self._key(matched))
+        if value is None:
+            # str.upper() and IGNORECASE disagree on a few characters (the
+            # Kelvin sign, dotted capital I); find the key the pattern matched.
+            for wrong, right in table.items():
+                if re.fullmatch(re.escape(wrong), matched, self.flags):
+                    return right
+            return matched
+        return value
+
+    def __call__(self, text):
+        for pattern, table in self.passes:
+            text = pattern.sub(lambda m: self._lookup(table, m.group(0)), text)
+        return text
+
+
+_MISSING = object()
+_caches = {}
+
+
+class NormalizationCache:
+    # Size-bounded LRU of raw string -> normalized result for one rule-pack
+    # version. Each process keeps its own copy (the lock is dropped when
+    # pickled); worker processes report their new entries and hit/miss
+    # counts back to the parent after every chunk, so the parent's copy is
+    # the one to save. With persistence on, the last save() for a version
+    # wins.
+
+    def __init__(self, name, version, maxsize=CACHE_MAXSIZE, persist=None):
+        self.name = name
+        self.version = version
+        self.maxsize = maxsize
+        self.persist = PERSIST_CACHES if persist is None else persist
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._fresh = deque(maxlen=maxsize)
+        self._reported = (0, 0)
+        self._lock = threading.Lock()
+        _caches[(name, version)] = self
+        if self.persist:
+            self.load()
+
+    @property
+    def path(self):
+        return os.path.join(CACHE_DIR, f'{self.name}-{self.version}.cache.json')
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get_or_compute(self, raw, fn):
+        with self._lock:
+            value = self._data.get(raw, _MISSING)
+            if value is not _MISSING:
+                self._data.move_to_end(raw)
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = fn(raw)
+        with self._lock:
+            self._data[raw] = value
+            self._fresh.append((raw, value))
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def drain(self):
+        # Entries and counts added since the last drain().
+        with self._lock:
+            fresh = list(self._fresh)
+            self._fresh.clear()
+            hits, misses = self.hits - self._reported[0], self.misses - self._reported[1]
+            self._reported = (self.hits, self.misses)
+        return fresh, hits, misses
+
+    def merge(self, fresh, hits, misses):
+        with self._lock:
+            for raw, value in fresh:
+                self._data[raw] = value
+                self._data.move_to_end(raw)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            self.hits += hits
+            self.misses += misses
+
+    def wrap(self, fn):
+        def cached(raw):
+            return self.get_or_compute(raw, fn)
+        cached.cache = self
+        cached.__wrapped__ = fn
+        return cached
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'name': self.name,
+            'version': self.version,
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            for raw, value in entries[-self.maxsize:]:
+                self._data.setdefault(raw, tuple(value) if isinstance(value, list) else value)
+
+    def save(self):
+        with self._lock:
+            entries = list(self._data.items())
+        write_json_atomic(self.path, entries)
+
+
+def drain_caches():
+    report = {}
+    for key, cache in _caches.items():
+        fresh, hits, misses = cache.drain()
+        if fresh or hits or misses:
+            report[key] = (fresh, hits, misses)
+    return report
+
+
+def merge_caches(report):
+    for key, delta in report.items():
+        if key in _caches:
+            _caches[key].merge(*delta)
+
+
+def _reset_after_fork():
+    # A forked worker starts from the parent's counts; only what it adds
+    # itself is reported back.
+    for cache in _caches.values():
+        cache._lock = threading.Lock()
+        cache._fresh.clear()
+        cache._reported = (cache.hits, cache.misses)
+
+
+add_worker_reporter('normalization', drain_caches, merge_caches)
+# Fork only exists on Unix; elsewhere workers are spawned with fresh state.
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def add_cache_arguments(parser):
+    parser.add_argument('--persist-cache', action='store_true',
+                        help=f'Load the normalization caches from {CACHE_DIR}/ at start and save them at the end.')
+
+
+def enable_persistence():
+    for cache in _caches.values():
+        if not cache.persist:
+            cache.persist = True
+            cache.load()
@@ -0,0 +1,103 @@
+import sys
+import json
+import argparse
+import atcc_text
+import atco2_text
+import uwb_text
+from executors import add_executor_arguments, imap_chunked, make_executor
+
+DEFAULT_CHUNK_SIZE = 2000
+CORPORA = ('uwb', 'atcc', 'atco2')
+
+# Only the text normalizers are imported, not the processing scripts and
+# their audio dependencies.
+NORMALIZERS = {
+    'uwb': uwb_text.normalize_transmission,
+    'atcc': atcc_text.normalize_transmission,
+    'atco2': atco2_text.normalize_transmission,
+}
+
+
+def normalize_record(uid, corpus, raw):
+    normalize = NORMALIZERS.get(corpus.lower())
+    if normalize is None:
+        return uid, corpus, None, 'unknown_corpus'
+    text, reason = normalize(raw)
+    return uid, corpus, text, reason
+
+
+def detect_format(path, default='jsonl'):
+    if path and path.endswith(('.tsv', '.tsv.txt')):
+        return 'tsv'
+    if path and path.endswith(('.jsonl', '.json')):
+        return 'jsonl'
+    return default
+
+
+def read_manifest(f, fmt):
+    for line_no, line in enumerate(f, 1):
+        line = line.rstrip('\n')
+        if not line.strip():
+            continue
+        if fmt == 'jsonl':
+            r = json.loads(line)
+            yield str(r['id']), r['corpus'], r['raw_text']
+        else:
+            parts = line.split('\t', 2)
+            if len(parts) != 3:
+                raise ValueError(f'line {line_no}: expected id<TAB>corpus<TAB>raw_text')
+            yield parts[0], parts[1], parts[2]
+
+
+def write_record(f, fmt, uid, corpus, text, reason):
+    if fmt == 'jsonl':
+        f.write(json.dumps(
+            {'id': uid, 'corpus': corpus, 'text': text, 'dropped': reason},
+            ensure_ascii=False,
+        ) + '\n')
+    else:
+        f.write(f"{uid}\t{corpus}\t{text or ''}\t{reason or ''}\n")
+
+
+def run(records, write, executor, chunk_size):
+    # Chunks are drained in submission order with a bounded number in
+    # flight, so output order matches input and memory stays flat.
+    for r in imap_chunked(executor, normalize_record, records, chunk_size, ordered=True):
+        write(*r)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Re-normalize transcript text from a JSONL or TSV manifest of (id, corpus, raw_text).'
+    )
+    parser.add_argument('input', help='Manifest path, or - for stdin.')
+    parser.add_argument('-o', '--output', default='-', help='Output path, or - for stdout.')
+    parser.add_argument('--format', choices=('jsonl', 'tsv'), help='Input format (default: from extension).')
+    parser.add_argument('--output-format', choices=('jsonl', 'tsv'), help='Output format (default: input format).')
+    add_executor_arguments(parser, default_backend='process', default_chunk_size=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    in_fmt = args.format or detect_format(args.input)
+    out_fmt = args.output_format or detect_format(args.output, in_fmt)
+    fin = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    fout = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    counts = {'kept': 0, 'dropped': 0}
+
+    def write(uid, corpus, text, reason):
+        counts['dropped' if text is None else 'kept'] += 1
+        write_record(fout, out_fmt, uid, corpus, text, reason)
+
+    try:
+        with make_executor(args.backend, args.workers) as executor:
+            run(read_manifest(fin, in_fmt), write, executor, args.chunk_size)
+    finally:
+        if fin is not sys.stdin:
+            fin.close()
+        if fout is not sys.stdout:
+            fout.close()
+    print(f"Normalized {counts['kept'] + counts['dropped']} transcripts "
+          f"({counts['kept']} kept, {counts['dropped']} dropped).", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
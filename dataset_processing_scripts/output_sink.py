@@ -0,0 +1,503 @@
+import io
+import os
+import json
+import time
+import tarfile
+import functools
+import threading
+from collections import namedtuple
+import soundfile as sf
+from materialize import materialize
+from segment_manifest import (
+    find_manifest,
+    manifest_path,
+    read_clip,
+    read_segment_manifest,
+    write_segment_manifest,
+)
+
+OUTPUT_FORMATS = ('dir', 'tar')
+VIRTUAL_FORMATS = ('virtual', 'virtual-parquet')
+SHARD_MAX_BYTES = 1 << 30
+SHARD_NAME = 'shard-{:06d}.tar'
+INDEX_NAME = 'index.jsonl'
+
+Sample = namedtuple('Sample', 'uid text text_path audio_path audio_bytes')
+
+
+def encode_wav(samples, sample_rate):
+    buf = io.BytesIO()
+    sf.write(buf, samples, sample_rate, subtype='PCM_16', format='WAV')
+    return buf.getvalue()
+
+
+def encode_text(text):
+    # Every transcript written from a string ends in exactly one newline,
+    # whatever its producer appended.
+    return (text.rstrip('\n') + '\n').encode('utf-8')
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def clear_markers(root):
+    # Drops the index/manifest a previous run in another layout left behind,
+    # so readers do not mistake the dataset for that layout.
+    for path in (os.path.join(root, INDEX_NAME), find_manifest(root)):
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+def remove_shards(root):
+    for f in os.listdir(root):
+        if f.startswith('shard-') and f.endswith('.tar'):
+            os.remove(os.path.join(root, f))
+
+
+def write_atomic(path, data):
+    # Written under a temporary name and renamed, so a killed run never
+    # leaves a truncated file under the final name.
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def fsync_path(path):
+    # Works for directories too, making the renames inside them durable.
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def segment_record(uid, text, source_path, start_sample, end_sample, sample_rate):
+    return {
+        'id': uid,
+        'source_path': os.path.abspath(source_path),
+        'start_sample': int(start_sample),
+        'end_sample': int(end_sample),
+        'sample_rate': int(sample_rate),
+        'text': text.strip(),
+    }
+
+
+def add_member(tar, name, data):
+    # Returns the [offset, size] of the member's data within the tar.
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    header = info.tobuf(tar.format, tar.encoding, tar.errors)
+    offset = tar.offset + len(header)
+    tar.addfile(info, io.BytesIO(data))
+    return [offset, info.size]
+
+
+def read_span(f, span):
+    f.seek(span[0])
+    return f.read(span[1])
+
+
+def trim_shard(path, rows):
+    # Cuts a shard back to the end of its last member listed in rows. When
+    # other members (of sources a killed run never finished) sit between
+    # those, the listed members are copied into a fresh shard instead and
+    # their offsets in rows updated, so the tar holds no stale duplicates.
+    names = {f"{r['id']}{ext}" for r in rows for ext in ('.wav', '.txt')}
+    end = max(span[0] + span[1] for r in rows for span in (r['wav'], r['txt']))
+    stray = False
+    try:
+        with tarfile.open(path) as tar:
+            for member in tar:
+                if member.offset_data >= end:
+                    break
+                if member.name not in names:
+                    stray = True
+                    break
+    except tarfile.TarError:
+        stray = True
+    if not stray:
+        end = -(-end // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        with open(path, 'r+b') as shard:
+            shard.truncate(end)
+            shard.seek(end)
+            shard.write(b'\0' * (2 * tarfile.BLOCKSIZE))
+        return
+    tmp_path = f'{path}.tmp'
+    with open(path, 'rb') as src, tarfile.open(tmp_path, 'w') as tar:
+        for row in sorted(rows, key=lambda r: r['wav'][0]):
+            wav = add_member(tar, f"{row['id']}.wav", read_span(src, row['wav']))
+            txt = add_member(tar, f"{row['id']}.txt", read_span(src, row['txt']))
+            row['wav'], row['txt'] = wav, txt
+    os.replace(tmp_path, path)
+
+
+def sample_exists(root, uid):
+    return (os.path.exists(os.path.join(root, 'audios', f'{uid}.wav'))
+            and os.path.exists(os.path.join(root, 'texts', f'{uid}.txt')))
+
+
+class DirectorySink:
+    # The original layout: audios/{uid}.wav and texts/{uid}.txt. IDs are
+    # content-addressed, so a sample already on disk from an earlier run is
+    # claimed rather than rewritten. With prune, close() also removes every
+    # sample this run did not claim; callers turn prune off when a source
+    # failed or was missing, as its earlier samples were never claimed.
+    # Every file is written under a temporary name and renamed into place.
+    virtual = False
+
+    def __init__(self, root, materialize_mode='copy', prune=False):
+        self.root = root
+        self.prune = prune
+        self.existing_root = root
+        self.audio_dir = os.path.join(root, 'audios')
+        self.text_dir = os.path.join(root, 'texts')
+        self.materialize_mode = materialize_mode
+        self.skipped = 0
+        self._seen = set()
+        self._unsynced = []
+        self._lock = threading.Lock()
+        os.makedirs(self.audio_dir, exist_ok=True)
+        os.makedirs(self.text_dir, exist_ok=True)
+        clear_markers(root)
+
+    def claim(self, uid):
+        # Returns False when the sample is already on disk and need not be
+        # produced again.
+        with self._lock:
+            self._seen.add(uid)
+        if sample_exists(self.root, uid):
+            with self._lock:
+                self.skipped += 1
+            return False
+        return True
+
+    def write(self, uid, text=None, text_path=None, samples=None, sample_rate=None,
+              audio_path=None, audio_bytes=None):
+        with self._lock:
+            self._seen.add(uid)
+        audio_dst = os.path.join(self.audio_dir, f'{uid}.wav')
+        if samples is not None:
+            sf.write(f'{audio_dst}.tmp', samples, sample_rate, subtype='PCM_16', format='WAV')
+            os.replace(f'{audio_dst}.tmp', audio_dst)
+        elif audio_path is not None:
+            materialize(audio_path, f'{audio_dst}.tmp', self.materialize_mode)
+            os.replace(f'{audio_dst}.tmp', audio_dst)
+        else:
+            write_atomic(audio_dst, audio_bytes)
+        text_dst = os.path.join(self.text_dir, f'{uid}.txt')
+        if text_path is not None:
+            materialize(text_path, f'{text_dst}.tmp', self.materialize_mode)
+            os.replace(f'{text_dst}.tmp', text_dst)
+        else:
+            write_atomic(text_dst, encode_text(text))
+        with self._lock:
+            self._unsynced.extend((audio_dst, text_dst))
+        return {'id': uid}
+
+    def flush(self):
+        # Makes the samples written since the last flush durable, so a run
+        # journal never lists a sample a crash could still lose.
+        with self._lock:
+            paths, self._unsynced = self._unsynced, []
+        for path in paths:
+            fsync_path(path)
+        if paths:
+            fsync_path(self.audio_dir)
+            fsync_path(self.text_dir)
+
+    def restore(self, entries):
+        # Samples of sources a resumed run skips are already on disk.
+        with self._lock:
+            self._seen.update(e['id'] for e in entries)
+
+    def close(self):
+        for folder, ext in ((self.audio_dir, '.wav'), (self.text_dir, '.txt')):
+            for f in os.listdir(folder):
+                uid, e = os.path.splitext(f)
+                if e == '.tmp' or (self.prune and e == ext and uid not in self._seen):
+                    os.remove(os.path.join(folder, f))
+
+
+class TarShardSink:
+    # WebDataset layout: each sample is a {uid}.wav / {uid}.txt member pair,
+    # written back to back into shards of at most max_shard_bytes. index.jsonl
+    # lists every sample with its shard and the byte offset and size of each
+    # member, so a reader can seek straight to one clip. A resumed run keeps
+    # the restored samples and appends new ones in fresh shards.
+    virtual = False
+    existing_root = None
+    skipped = 0
+
+    def __init__(self, root, max_shard_bytes=SHARD_MAX_BYTES, resume=False):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.max_shard_bytes = max_shard_bytes
+        self.count = 0
+        self._lock = threading.Lock()
+        self._shard = -1
+        self._tar = None
+        self._index_path = os.path.join(root, INDEX_NAME)
+        if resume:
+            # Opened once restore() has pruned the old index.
+            self._index = None
+            return
+        clear_markers(root)
+        remove_shards(root)
+        self._index = open(self._index_path, 'w', encoding='utf-8')
+
+    def restore(self, entries):
+        # Keeps only the index rows of restored samples, trims each old shard
+        # down to its kept members (a killed run can leave half-written ones,
+        # or whole samples of unfinished sources) and starts new shards after
+        # the highest old one.
+        keep = {e['id'] for e in entries}
+        rows = []
+        if os.path.exists(self._index_path):
+            with open(self._index_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        break
+                    if row['id'] in keep:
+                        rows.append(row)
+        by_shard = {}
+        for row in rows:
+            by_shard.setdefault(row['shard'], []).append(row)
+        for f in sorted(os.listdir(self.root)):
+            if not (f.startswith('shard-') and f.endswith('.tar')):
+                continue
+            if f in by_shard:
+                trim_shard(os.path.join(self.root, f), by_shard[f])
+            else:
+                os.remove(os.path.join(self.root, f))
+        self._shard = max((int(f[6:12]) for f in by_shard), default=-1)
+        self.count = len(rows)
+        tmp_path = f'{self._index_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row) + '\n')
+        os.replace(tmp_path, self._index_path)
+        self._index = open(self._index_path, 'a', encoding='utf-8')
+
+    def _roll(self):
+        if self._tar is not None:
+            self._tar.close()
+        self._shard += 1
+        self._shard_name = SHARD_NAME.format(self._shard)
+        self._tar = tarfile.open(os.path.join(self.root, self._shard_name), 'w')
+        self._shard_samples = 0
+
+    def write(self, uid, text=None, text_path=None, samples=None, sample_rate=None,
+              audio_path=None, audio_bytes=None):
+        if samples is not None:
+            audio_bytes = encode_wav(samples, sample_rate)
+        elif audio_path is not None:
+            audio_bytes = read_bytes(audio_path)
+        text_bytes = read_bytes(text_path) if text_path is not None else encode_text(text)
+        size = len(audio_bytes) + len(text_bytes) + 4 * tarfile.BLOCKSIZE
+        with self._lock:
+            if self._tar is None or (
+                self._shard_samples and self._tar.offset + size > self.max_shard_bytes
+            ):
+                self._roll()
+            wav = add_member(self._tar, f'{uid}.wav', audio_bytes)
+            txt = add_member(self._tar, f'{uid}.txt', text_bytes)
+            self._shard_samples += 1
+            self.count += 1
+            self._index.write(json.dumps(
+                {'id': uid, 'shard': self._shard_name, 'wav': wav, 'txt': txt}
+            ) + '\n')
+        return {'id': uid}
+
+    def flush(self):
+        with self._lock:
+            if self._tar is not None:
+                self._tar.fileobj.flush()
+                os.fsync(self._tar.fileobj.fileno())
+            self._index.flush()
+            os.fsync(self._index.fileno())
+
+    def close(self):
+        with self._lock:
+            if self._tar is not None:
+                self._tar.close()
+                self._tar = None
+            self._index.close()
+
+    def claim(self, uid):
+        return True
+
+
+class VirtualManifestSink:
+    # Writes no audio at all: each segment becomes a manifest row pointing at
+    # a sample range of its source recording, read back lazily through
+    # segment_manifest.SegmentDataset.
+    virtual = True
+    existing_root = None
+    skipped = 0
+
+    def __init__(self, root, fmt='jsonl'):
+        os.makedirs(root, exist_ok=True)
+        clear_markers(root)
+        self.path = manifest_path(root, fmt)
+        self.records = []
+        self._lock = threading.Lock()
+
+    def claim(self, uid):
+        return True
+
+    def write_segment(self, uid, text, source_path, start_sample, end_sample, sample_rate):
+        record = segment_record(uid, text, source_path, start_sample, end_sample, sample_rate)
+        with self._lock:
+            self.records.append(record)
+        return record
+
+    def flush(self):
+        # Rows live in memory until close(); a run journal holds them until then.
+        pass
+
+    def restore(self, entries):
+        with self._lock:
+            self.records.extend(entries)
+
+    def close(self):
+        with self._lock:
+            self.records.sort(key=lambda r: (r['source_path'], r['start_sample'], r['id']))
+            write_segment_manifest(self.path, self.records)
+
+
+class BufferedSink:
+    # Stands in for the real sink inside a worker process, where open shards
+    # and manifests cannot follow: writes are recorded (audio already encoded,
+    # so the CPU work stays in the worker) and replayed by the parent.
+
+    def __init__(self, virtual=False, existing_root=None):
+        self.virtual = virtual
+        self.existing_root = existing_root
+        self.calls = []
+
+    def claim(self, uid):
+        self.calls.append(('claim', (uid,), {}))
+        return self.existing_root is None or not sample_exists(self.existing_root, uid)
+
+    def write(self, uid, text=None, text_path=None, samples=None, sample_rate=None,
+              audio_path=None, audio_bytes=None):
+        if samples is not None:
+            audio_bytes = encode_wav(samples, sample_rate)
+        self.calls.append(('write', (uid,), {
+            'text': text, 'text_path': text_path, 'audio_path': audio_path, 'audio_bytes': audio_bytes,
+        }))
+        return {'id': uid}
+
+    def write_segment(self, *args):
+        self.calls.append(('write_segment', args, {}))
+        return segment_record(*args)
+
+
+def run_buffered(fn, virtual, existing_root, *args):
+    sink = BufferedSink(virtual, existing_root)
+    return fn(*args, sink), sink.calls
+
+
+def run_direct(fn, sink, *args):
+    return fn(*args, sink), None
+
+
+def bind_sink(fn, sink, backend):
+    # Returns a task calling fn(*args, sink) that yields (result, calls);
+    # replay_calls(sink, calls) must then be run in the parent.
+    if backend == 'process' and sink is not None:
+        return functools.partial(run_buffered, fn, sink.virtual, sink.existing_root)
+    return functools.partial(run_direct, fn, sink)
+
+
+def replay_calls(sink, calls):
+    for name, args, kwargs in calls or ():
+        getattr(sink, name)(*args, **kwargs)
+
+
+def add_sink_arguments(parser, virtual=False):
+    formats = OUTPUT_FORMATS + VIRTUAL_FORMATS if virtual else OUTPUT_FORMATS
+    parser.add_argument('--output-format', choices=formats, default='dir',
+                        help='dir: audios/ and texts/ folders; tar: WebDataset tar shards with index.jsonl'
+                             + ('; virtual / virtual-parquet: a segments.jsonl / segments.parquet manifest '
+                                'of sample ranges into the source recordings, with no audio written.'
+                                if virtual else '.'))
+    parser.add_argument('--shard-size-mb', type=int, default=SHARD_MAX_BYTES >> 20,
+                        help='Upper bound on the size of each tar shard.')
+    parser.add_argument('--prune', action='store_true',
+                        help='With dir output, remove samples this run did not produce. Nothing is '
+                             'removed when a source failed or an input dataset is missing.')
+
+
+def open_sink(root, output_format='dir', materialize_mode='copy', max_shard_bytes=SHARD_MAX_BYTES,
+              resume=False, prune=False):
+    # With resume, the caller must pass the samples to keep to restore()
+    # before writing anything.
+    if output_format == 'tar':
+        return TarShardSink(root, max_shard_bytes, resume)
+    if output_format == 'dir':
+        return DirectorySink(root, materialize_mode, prune)
+    if output_format == 'virtual':
+        return VirtualManifestSink(root, 'jsonl')
+    if output_format == 'virtual-parquet':
+        return VirtualManifestSink(root, 'parquet')
+    raise ValueError(f'unknown output format {output_format!r}')
+
+
+def is_sharded(root):
+    return os.path.exists(os.path.join(root, INDEX_NAME))
+
+
+def list_ids(root):
+    if is_virtual(root):
+        return [r['id'] for r in read_segment_manifest(find_manifest(root))]
+    if is_sharded(root):
+        with open(os.path.join(root, INDEX_NAME), encoding='utf-8') as f:
+            return [json.loads(line)['id'] for line in f if line.strip()]
+    audio_dir, text_dir = os.path.join(root, 'audios'), os.path.join(root, 'texts')
+    texts = set(os.listdir(text_dir))
+    return [
+        os.path.splitext(f)[0] for f in os.listdir(audio_dir)
+        if f.endswith('.wav') and f'{os.path.splitext(f)[0]}.txt' in texts
+    ]
+
+
+def is_virtual(root):
+    return find_manifest(root) is not None
+
+
+def iter_samples(root, target_sr=None):
+    # Yields Samples from any layout: file paths for a directory dataset,
+    # in-memory bytes (read sequentially, shard by shard) for a sharded one,
+    # and clips sliced from the source recordings for a virtual one.
+    if is_virtual(root):
+        for record in read_segment_manifest(find_manifest(root)):
+            audio, sr = read_clip(record, target_sr)
+            yield Sample(record['id'], record['text'], None, None, encode_wav(audio, sr))
+        return
+    if not is_sharded(root):
+        for uid in list_ids(root):
+            yield Sample(
+                uid, None, os.path.join(root, 'texts', f'{uid}.txt'),
+                os.path.join(root, 'audios', f'{uid}.wav'), None,
+            )
+        return
+    # Members are read at the offsets the index records, so anything else a
+    # killed run left in a shard is never returned.
+    with open(os.path.join(root, INDEX_NAME), encoding='utf-8') as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    by_shard = {}
+    for row in rows:
+        by_shard.setdefault(row['shard'], []).append(row)
+    for shard, shard_rows in by_shard.items():
+        with open(os.path.join(root, shard), 'rb') as f:
+            for row in sorted(shard_rows, key=lambda r: r['wav'][0]):
+                audio_bytes = read_span(f, row['wav'])
+                text = read_span(f, row['txt']).decode('utf-8')
+                yield Sample(row['id'], text, None, None, audio_bytes)
@@ -0,0 +1,202 @@
+import queue
+import threading
+import time
+from executors import chunk_results, submit_chunk
+
+DEFAULT_QUEUE_SIZE = 64
+_DONE = object()
+
+
+class Stage:
+    # One step of a Pipeline. fn maps an item to its output, or to None to
+    # drop it; with fan_out it returns an iterable of outputs instead. With
+    # an executor, each of the stage's worker threads hands batches of up to
+    # batch_size items to it and waits for the results, so the work itself
+    # can run in another process while the queues stay in this one. With
+    # batched, fn takes the whole batch and returns one result per item.
+    # on_drop, if given, is called in this process with every input item fn
+    # dropped.
+
+    def __init__(self, name, fn, workers=1, fan_out=False, executor=None, batch_size=1,
+                 on_drop=None, batched=False):
+        self.name = name
+        self.fn = fn
+        self.on_drop = on_drop
+        self.batched = batched
+        self.workers = max(workers, 1)
+        self.fan_out = fan_out
+        self.executor = executor
+        self.batch_size = max(batch_size, 1)
+        self.items_in = 0
+        self.items_out = 0
+        self.depth_max = 0
+        self.depth_total = 0
+        self.blocked = 0.0
+        self.idle = 0.0
+        self._lock = threading.Lock()
+
+    def apply(self, batch):
+        calls = [(batch,)] if self.batched else [(x,) for x in batch]
+        if self.executor is not None:
+            results = chunk_results(submit_chunk(self.executor, self.fn, calls))
+        else:
+            results = [self.fn(*args) for args in calls]
+        if self.batched:
+            results = results[0]
+        out = []
+        for item, result in zip(batch, results):
+            if result is None:
+                if self.on_drop is not None:
+                    self.on_drop(item)
+                continue
+            if self.fan_out:
+                out.extend(result)
+            else:
+                out.append(result)
+        return out
+
+    def record(self, taken, depth, idle):
+        with self._lock:
+            self.items_in += taken
+            self.depth_max = max(self.depth_max, depth)
+            self.depth_total += depth * taken
+            self.idle += idle
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'in': self.items_in,
+            'out': self.items_out,
+            'queue_max': self.depth_max,
+            'queue_mean': round(self.depth_total / self.items_in, 1) if self.items_in else 0.0,
+            'blocked_s': round(self.blocked, 2),
+            'idle_s': round(self.idle, 2),
+        }
+
+
+class Pipeline:
+    # Runs items through a chain of stages joined by bounded queues: a stage
+    # whose output queue is full blocks until the next stage catches up, so
+    # the number of items alive at once is fixed by the queue sizes, however
+    # long the input is. The last stage's outputs are discarded; it is
+    # normally the one that writes. With inline, every item is pushed
+    # through all stages on the calling thread instead (the serial backend).
+
+    def __init__(self, stages, queue_size=DEFAULT_QUEUE_SIZE, inline=False):
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self.inline = inline
+        self._error = None
+
+    def depths(self):
+        return {stage.name: q.qsize() for stage, q in zip(self.stages, self.queues)}
+
+    def stats(self):
+        return {stage.name: stage.stats() for stage in self.stages}
+
+    def run(self, source):
+        if self.inline:
+            for item in source:
+                self._push(0, item)
+            return
+        remaining = [stage.workers for stage in self.stages]
+        lock = threading.Lock()
+        threads = []
+        for i, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                t = threading.Thread(target=self._work, args=(i, remaining, lock), daemon=True)
+                t.start()
+                threads.append(t)
+        try:
+            for item in source:
+                if self._error is not None:
+                    break
+                self.queues[0].put(item)
+        finally:
+            for _ in range(self.stages[0].workers):
+                self.queues[0].put(_DONE)
+            for t in threads:
+                t.join()
+        if self._error is not None:
+            raise self._error
+
+    def _push(self, i, item):
+        stage = self.stages[i]
+        stage.record(1, 0, 0.0)
+        for out in stage.apply([item]):
+            stage.items_out += 1
+            if i + 1 < len(self.stages):
+                self._push(i + 1, out)
+
+    def _take(self, q, batch_size):
+        # Blocks for the first item, then tops the batch up with whatever is
+        # already queued.
+        item = q.get()
+        if item is _DONE:
+            return [], True
+        batch = [item]
+        while len(batch) < batch_size:
+            try:
+                item = q.get_nowait()
+            except queue.Empty:
+                break
+            if item is _DONE:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _work(self, i, remaining, lock):
+        stage = self.stages[i]
+        q_in = self.queues[i]
+        q_out = self.queues[i + 1] if i + 1 < len(self.stages) else None
+        done = False
+        while not done:
+            t0 = time.perf_counter()
+            depth = q_in.qsize()
+            batch, done = self._take(q_in, stage.batch_size)
+            if not batch:
+                break
+            stage.record(len(batch), depth, time.perf_counter() - t0)
+            if self._error is not None:
+                continue
+            try:
+                outputs = stage.apply(batch)
+            except BaseException as e:
+                self._error = self._error or e
+                continue
+            if q_out is None:
+                with stage._lock:
+                    stage.items_out += len(outputs)
+                continue
+            t0 = time.perf_counter()
+            for out in outputs:
+                q_out.put(out)
+            with stage._lock:
+                stage.items_out += len(outputs)
+                stage.blocked += time.perf_counter() - t0
+        with lock:
+            remaining[i] -= 1
+            last = remaining[i] == 0
+        if last and q_out is not None:
+            for _ in range(self.stages[i + 1].workers):
+                q_out.put(_DONE)
+
+
+def parse_stage_workers(value):
+    counts = {}
+    for part in value.split(','):
+        if part.strip():
+            name, _, n = part.partition('=')
+            counts[name.strip()] = int(n)
+    return counts
+
+
+def add_pipeline_arguments(parser):
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE,
+                        help='Items held between two pipeline stages before the upstream one blocks.')
+    parser.add_argument('--stage-workers', type=parse_stage_workers, default={},
+                        help='Per-stage worker counts, e.g. normalize=8,slice=32.')
+
+
+def stage_workers(args, name, default):
+    return args.stage_workers.get(name, default)
@@ -1,198 +1,380 @@
 import os
-import random
-import string
+import json
+import argparse
+import functools
 import re
 import subprocess
+import sys
+import mmap
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from pydub import AudioSegment
+import numpy as np
+import resampy
 from tqdm import tqdm
-from utils import atc_0_general_corrections
-
-RANDOM_SEED = 42
-random.seed(RANDOM_SEED)
-
-SEGMENT_ID_LENGTH = 20
+from normalization import add_cache_arguments, enable_persistence, write_json_atomic
+from atcc_text import ATCC_TEXT_CLEANER, clean_whitespace
+from executors import add_executor_arguments, make_executor
+from output_sink import add_sink_arguments, encode_wav, open_sink
+from pipeline import Pipeline, Stage, add_pipeline_arguments, stage_workers
+from run_journal import RunJournal, add_resume_argument
+from segment_ids import segment_id, source_key
+from segment_index import open_segment_index, segment_index_stats
+from sphere import SphereReader
+from wav_memmap import WavMemmap
 
 INPUT_DIR = 'ATCC_Raw_Data'
 DATASET_DIR = 'ATCC_Dataset'
-AUDIO_OUTPUT_DIR = os.path.join(DATASET_DIR, 'audios')
-TEXT_OUTPUT_DIR = os.path.join(DATASET_DIR, 'texts')
 SUBFOLDERS = ['atc0_bos', 'atc0_dca', 'atc0_dfw']
+TARGET_SR = 16000
+SEGMENT_CHUNK_SIZE = 64
+MAX_OPEN_RECORDINGS = 8
+RESAMPLE_CONTEXT_S = 0.05
+TRANSCODE_WORKERS = os.cpu_count() or 1
+TRANSCODE_STATUS_PATH = os.path.join(INPUT_DIR, '.transcode_status.json')
+
 
-for d in (AUDIO_OUTPUT_DIR, TEXT_OUTPUT_DIR):
-    os.makedirs(d, exist_ok=True)
+def native_readable(path):
+    try:
+        SphereReader(path)
+    except (OSError, ValueError, KeyError):
+        return False
+    return True
 
 
-def normalize_audio_files(folder_path):
+def transcode_jobs(folder_path):
+    # Uncompressed SPHERE and any WAV are read in-process; only SPHERE
+    # codings the native reader does not handle (e.g. embedded-shorten)
+    # still go through ffmpeg.
     audio_path = os.path.join(folder_path, 'data', 'audio')
-    for fname in os.listdir(audio_path):
-        if fname.endswith(('.sph', '.wav')):
-            in_path = os.path.join(audio_path, fname)
-            base, _ = os.path.splitext(in_path)
-            tmp_path = base + '.temp.wav'
-            out_path = base + '.wav'
-            try:
-                subprocess.run(
-                    ['ffmpeg', '-y', '-i', in_path, '-ar', '16000', '-ac', '1', tmp_path],
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL,
-                    check=True
-                )
-                os.replace(tmp_path, out_path)
-                if fname.endswith('.sph'):
-                    os.remove(in_path)
-            except subprocess.CalledProcessError:
-                continue
-
-
-def generate_unique_id(existing_ids, length=SEGMENT_ID_LENGTH):
-    chars = string.ascii_uppercase + string.digits
-    while True:
-        uid = ''.join(random.choices(chars, k=length))
-        if uid not in existing_ids:
-            existing_ids.add(uid)
-            return uid
-
-
-def clean_whitespace(s):
-    return re.sub(r'\s+', ' ', s).strip()
-
-
-def extract_balanced_parens(data, start_idx):
-    depth = 0
-    for idx in range(start_idx, len(data)):
-        if data[idx] == '(':
-            depth += 1
-        elif data[idx] == ')':
-            depth -= 1
-            if depth == 0:
-                return data[start_idx + 1:idx], idx + 1
-    raise ValueError
-
-
-def parse_transcript(path):
-    data = open(path, encoding='utf-8').read()
-    idx = 0
-    out = []
-    while True:
-        tpos = data.find('(TEXT', idx)
-        if tpos < 0:
-            break
-        raw_text, after_text = extract_balanced_parens(data, tpos)
-        parts = raw_text.split(maxsplit=1)
-        text = clean_whitespace(parts[1] if len(parts) == 2 else '')
-        t2 = data.find('(TIMES', after_text)
-        if t2 < 0:
-            break
-        raw_times, idx = extract_balanced_parens(data, t2)
-        times = raw_times.split()
-        if len(times) >= 3:
-            start, end = float(times[1]), float(times[2])
-            out.append((text, start, end))
-    return out
-
-
-TAGS_OMIT = [
-    '(UNINTELLIGIBLE)',
-    'UNINTELLIGIBLE',
-    '(MIC KEYED TWICE)',
-    '(CARRIER TRANSMITTED ONLY)',
-]
-
-TAGS_REMOVE = [
-    'LONG PAUSE',
-    'SHORT PAUSE',
-    'BREAK',
-    'GARBLED',
-    'LAUGHTER',
-    '/',
-    '//',
-]
-
-OMIT_REGEX = [
-    re.compile(r'\(?'+t.replace(' ', '[-\\s]')+r'\)?', re.IGNORECASE) for t in TAGS_REMOVE
-]
-STUTTER_RE = re.compile(r'\b\w+-\s+(\w+)\b', re.IGNORECASE)
-QUOTE_RE = re.compile(r'\(QUOTE\s+([A-Z]+)\)', re.IGNORECASE)
-PLAIN_QUOTE = re.compile(r'\bQUOTE\s+([A-Z]+)\b', re.IGNORECASE)
-CONTRACTION_RE = re.compile(
-    r"\b([A-Z]+)\s+'\s*(RE|LL|VE|D|S|M|T|AM)\b", re.IGNORECASE
-)
-OCLOCK_RE = re.compile(r"\b(O)\s+'\s*(CLOCK)\b", re.IGNORECASE)
-
-
-def fix_quotes(line):
-    line = QUOTE_RE.sub(lambda m: f"'{m.group(1)}", line)
-
-    def repl(m):
-        return f"'{m.group(1)}" if m.start() == 0 or line[m.start() - 1].isspace() else m.group(0)
-
-    return PLAIN_QUOTE.sub(repl, line)
-
-
-def process_segment(audio, raw_text, start_s, end_s, used_ids):
-    if any(tag in raw_text for tag in TAGS_OMIT):
+    if not os.path.isdir(audio_path):
+        return []
+    return [
+        os.path.join(audio_path, f)
+        for f in sorted(os.listdir(audio_path))
+        if f.endswith('.sph') and not native_readable(os.path.join(audio_path, f))
+    ]
+
+
+def transcode_file(in_path):
+    base, _ = os.path.splitext(in_path)
+    tmp_path = base + '.temp.wav'
+    out_path = base + '.wav'
+    proc = subprocess.run(
+        ['ffmpeg', '-y', '-i', in_path, '-ar', str(TARGET_SR), '-ac', '1', '-c:a', 'pcm_s16le', tmp_path],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    if proc.returncode != 0:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        lines = proc.stderr.decode('utf-8', 'replace').strip().splitlines()
+        return f'failed: {lines[-1] if lines else f"ffmpeg exited with {proc.returncode}"}'
+    os.replace(tmp_path, out_path)
+    if in_path.endswith('.sph'):
+        os.remove(in_path)
+    return 'transcoded'
+
+
+def transcode_audio(folders, workers=TRANSCODE_WORKERS, status_path=TRANSCODE_STATUS_PATH,
+                    retry_failed=False):
+    # Runs ffmpeg over every recording that still needs it, in a bounded
+    # pool. Each result is written to the status file as it lands, so an
+    # interrupted run picks up with whatever has not been transcoded yet.
+    # Recordings that failed before are skipped unless retry_failed is set.
+    status = {}
+    if os.path.exists(status_path):
+        with open(status_path, encoding='utf-8') as f:
+            status = json.load(f)
+
+    def pending(path):
+        state = status.get(os.path.relpath(path, INPUT_DIR), '')
+        if state.startswith('failed'):
+            return retry_failed
+        return not (state == 'transcoded' and os.path.exists(os.path.splitext(path)[0] + '.wav'))
+
+    jobs = []
+    skipped = 0
+    for folder in folders:
+        for path in transcode_jobs(folder):
+            if pending(path):
+                jobs.append(path)
+            else:
+                skipped += 1
+    if skipped:
+        print(f'Skipped {skipped} recordings already transcoded or failed before '
+              '(--retry-failed tries the failed ones again).', file=sys.stderr)
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(transcode_file, p): p for p in jobs}
+        for future in tqdm(as_completed(futures), total=len(futures), desc='Transcoding Audio'):
+            key = os.path.relpath(futures[future], INPUT_DIR)
+            status[key] = future.result()
+            write_json_atomic(status_path, status)
+            if status[key].startswith('failed'):
+                failed.append(key)
+    for key in sorted(failed):
+        print(f'Transcoding {key} {status[key]}', file=sys.stderr)
+    return len(jobs), len(failed)
+
+
+SEXP_TOKEN_RE = re.compile(rb'\(TEXT|\(TIMES|[()]')
+SEEK_TEXT, IN_TEXT, SEEK_TIMES, IN_TIMES = range(4)
+TRANSCRIPT_PARSER_VERSION = 'atcc-sexp-1'
+
+
+def iter_transcript(path, malformed=None):
+    # Streams (text, start, end) records out of an ATCC (TEXT ...)(TIMES ...)
+    # transcript in one pass over the memory-mapped file, stepping from paren
+    # to paren. Malformed blocks are appended to `malformed` as
+    # (path, byte_offset, reason) instead of raising.
+    def report(offset, reason):
+        if malformed is not None:
+            malformed.append((path, offset, reason))
+
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            state = SEEK_TEXT
+            depth = tpos = tend = t2 = 0
+            for m in SEXP_TOKEN_RE.finditer(buf):
+                tok = m.group()
+                if state == SEEK_TEXT:
+                    if tok == b'(TEXT':
+                        state, depth, tpos = IN_TEXT, 1, m.start()
+                elif state == SEEK_TIMES:
+                    if tok == b'(TIMES':
+                        state, depth, t2 = IN_TIMES, 1, m.start()
+                elif tok != b')':
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth:
+                        continue
+                    if state == IN_TEXT:
+                        state, tend = SEEK_TIMES, m.start()
+                        continue
+                    state = SEEK_TEXT
+                    record = parse_block(buf, tpos, tend, t2, m.start(), report)
+                    if record:
+                        yield record
+            if state == IN_TEXT:
+                report(tpos, 'unbalanced TEXT block')
+            elif state == SEEK_TIMES:
+                report(tpos, 'TEXT block without TIMES')
+            elif state == IN_TIMES:
+                report(t2, 'unbalanced TIMES block')
+
+
+def parse_block(buf, tpos, tend, t2, t2end, report):
+    try:
+        parts = buf[tpos + 1:tend].decode('utf-8').split(maxsplit=1)
+    except UnicodeDecodeError:
+        report(tpos, 'TEXT block is not valid UTF-8')
         return None
-    if re.search(r'\d', raw_text) or '[' in raw_text or ']' in raw_text:
+    times = buf[t2 + 1:t2end].split()
+    if len(times) < 3:
+        report(t2, 'TIMES block without start and end')
         return None
-    txt = raw_text.replace(';', '').replace('`', "'")
-    for rx in OMIT_REGEX:
-        txt = rx.sub('', txt)
-    txt = txt.replace('(', ' ').replace(')', ' ')
-    if 'QUOTE' in txt or '(QUOTE' in txt:
-        txt = fix_quotes(txt)
-    txt = STUTTER_RE.sub(r'\1', txt)
-    txt = re.sub(r'\s*-\s*$', '', txt)
-    txt = CONTRACTION_RE.sub(r"\1'\2", txt)
-    txt = OCLOCK_RE.sub(r"\1'\2", txt)
-    for wrong, right in atc_0_general_corrections.items():
-        txt = re.sub(rf'\b{re.escape(wrong)}\b', right, txt, flags=re.IGNORECASE)
-    txt = clean_whitespace(txt)
-    if not txt or '"' in txt:
+    try:
+        start, end = float(times[1]), float(times[2])
+    except ValueError:
+        report(t2, 'TIMES block with non-numeric times')
         return None
-    uid = generate_unique_id(used_ids)
-    clip = audio[int(start_s * 1000):int(end_s * 1000)].set_frame_rate(16000)
-    clip.export(os.path.join(AUDIO_OUTPUT_DIR, f'{uid}.wav'), format='wav')
-    with open(os.path.join(TEXT_OUTPUT_DIR, f'{uid}.txt'), 'w', encoding='utf-8') as f:
-        f.write(txt + '\n')
-    return txt
+    return clean_whitespace(parts[1] if len(parts) == 2 else ''), start, end
+
+
+def parse_transcript(path, malformed=None):
+    return list(iter_transcript(path, malformed))
+
+
+@functools.lru_cache(maxsize=MAX_OPEN_RECORDINGS)
+def open_recording(path):
+    return SphereReader(path) if path.endswith('.sph') else WavMemmap(path)
+
+
+def segment_frames(audio, start_s, end_s):
+    sr = audio.sample_rate
+    start = min(max(int(int(start_s * 1000) * sr / 1000), 0), audio.frames)
+    end = min(max(int(int(end_s * 1000) * sr / 1000), start), audio.frames)
+    return start, end
+
+
+def read_segment(audio_path, start_s, end_s):
+    # Reads only the segment's frames from the memory-mapped recording and,
+    # if needed, downmixes and resamples that block to 16 kHz. The block is
+    # padded with RESAMPLE_CONTEXT_S of neighbouring audio so the resampling
+    # filter sees real signal at the edges; the padding is trimmed off after.
+    # Positions are truncated to whole milliseconds first, as the old
+    # millisecond-indexed AudioSegment slice did.
+    audio = open_recording(audio_path)
+    sr = audio.sample_rate
+    start, end = segment_frames(audio, start_s, end_s)
+    if sr == TARGET_SR:
+        block = audio.read(start, end)
+        return block[:, 0] if audio.channels == 1 else block.mean(axis=1).astype(np.int16)
+    pad = int(RESAMPLE_CONTEXT_S * sr)
+    lo, hi = max(start - pad, 0), min(end + pad, audio.frames)
+    block = audio.read(lo, hi).astype(np.float32).mean(axis=1) / 32768
+    resampled = resampy.resample(block, sr, TARGET_SR)
+    offset = int(round((start - lo) * TARGET_SR / sr))
+    length = int(round((end - start) * TARGET_SR / sr))
+    clip = resampled[offset:offset + length] * 32768
+    return np.clip(np.round(clip), -32768, 32767).astype(np.int16)
+
+
+def iter_recordings(folders):
+    for fp in folders:
+        audio_dir = os.path.join(fp, 'data', 'audio')
+        transcript_dir = os.path.join(fp, 'data', 'transcripts')
+        if not os.path.isdir(audio_dir) or not os.path.isdir(transcript_dir):
+            continue
+        recordings = {}
+        for f in sorted(os.listdir(audio_dir), key=lambda f: f.endswith('.wav')):
+            base, ext = os.path.splitext(f)
+            if ext in ('.sph', '.wav') and not base.endswith('.temp'):
+                recordings[base] = os.path.join(audio_dir, f)
+        txts = {
+            os.path.splitext(f)[0]: os.path.join(transcript_dir, f)
+            for f in os.listdir(transcript_dir)
+            if f.endswith('.txt')
+        }
+        for k in sorted(set(recordings) & set(txts)):
+            yield txts[k], recordings[k]
+
+
+# Pipeline stages. Each item is (audio_path, raw_text, start, end) until
+# normalized, then (uid, audio_path, text, start, end), and after slicing
+# (uid, audio_path, text, start_frame, end_frame, sample_rate, audio), where
+# audio is None for virtual output and becomes WAV bytes after encoding.
+
+def parse_recording(recording, malformed):
+    txt_path, audio_path = recording
+    segments = open_segment_index(INPUT_DIR).segments(
+        'atcc',
+        txt_path,
+        audio_path,
+        lambda p: ((s, e, raw) for raw, s, e in iter_transcript(p, malformed)),
+        TRANSCRIPT_PARSER_VERSION,
+    )
+    return [(audio_path, raw, s, e) for s, e, raw in segments]
+
+
+def normalize_segments(items):
+    cleaned, _ = ATCC_TEXT_CLEANER.clean_batch([raw for _, raw, _, _ in items])
+    return [
+        None if txt is None
+        else (segment_id('atcc', source_key(audio_path, INPUT_DIR), s, e, txt), audio_path, txt, s, e)
+        for (audio_path, _, s, e), txt in zip(items, cleaned)
+    ]
+
+
+def slice_segment(item, virtual=False):
+    uid, audio_path, txt, s, e = item
+    try:
+        if virtual:
+            recording = open_recording(audio_path)
+            start, end = segment_frames(recording, s, e)
+            return uid, audio_path, txt, start, end, recording.sample_rate, None
+        return uid, audio_path, txt, None, None, TARGET_SR, read_segment(audio_path, s, e)
+    except Exception:
+        return None
+
+
+def encode_segment(item):
+    if item[6] is None:
+        return item
+    return item[:6] + (encode_wav(item[6], item[5]),)
+
+
+def write_segment(sink, item):
+    uid, audio_path, txt, start, end, sr, wav = item
+    if sink.virtual:
+        return sink.write_segment(uid, txt, audio_path, start, end, sr)
+    return sink.write(uid, text=txt, audio_bytes=wav)
 
 
 def main():
-    used_ids = set()
-    futures = []
-    with ThreadPoolExecutor() as executor:
-        for folder in SUBFOLDERS:
-            fp = os.path.join(INPUT_DIR, folder)
-            normalize_audio_files(fp)
-            audio_dir = os.path.join(fp, 'data', 'audio')
-            transcript_dir = os.path.join(fp, 'data', 'transcripts')
-            if not os.path.isdir(audio_dir) or not os.path.isdir(transcript_dir):
-                continue
-            wavs = {
-                os.path.splitext(f)[0]: os.path.join(audio_dir, f)
-                for f in os.listdir(audio_dir)
-                if f.endswith('.wav')
-            }
-            txts = {
-                os.path.splitext(f)[0]: os.path.join(transcript_dir, f)
-                for f in os.listdir(transcript_dir)
-                if f.endswith('.txt')
-            }
-            for k in set(wavs) & set(txts):
-                audio = AudioSegment.from_wav(wavs[k])
-                for raw, s, e in parse_transcript(txts[k]):
-                    futures.append(
-                        executor.submit(
-                            process_segment, audio, raw, s, e, used_ids
-                        )
-                    )
-        for _ in tqdm(
-            as_completed(futures),
-            total=len(futures),
-            desc='Processing Dataset',
-        ):
-            pass
+    parser = argparse.ArgumentParser(description='Process the ATCC corpus into clips and transcripts.')
+    add_sink_arguments(parser, virtual=True)
+    add_executor_arguments(parser, default_chunk_size=SEGMENT_CHUNK_SIZE)
+    add_pipeline_arguments(parser)
+    add_resume_argument(parser)
+    add_cache_arguments(parser)
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='Transcode recordings again that failed in an earlier run.')
+    args = parser.parse_args()
+    if args.persist_cache:
+        enable_persistence()
+    sink = open_sink(DATASET_DIR, args.output_format, max_shard_bytes=args.shard_size_mb << 20,
+                     resume=args.resume, prune=args.prune)
+    journal = RunJournal(DATASET_DIR, args.resume, sink)
+    if args.resume:
+        sink.restore(journal.segments())
+    folders = [os.path.join(INPUT_DIR, folder) for folder in SUBFOLDERS]
+    transcoded, failed = transcode_audio(folders, retry_failed=args.retry_failed)
+    print(f'Transcoded {transcoded - failed}/{transcoded} recordings.')
+    malformed = []
+    progress = tqdm(desc='Processing Dataset')
+    # Normalization and slicing are the CPU-bound stages; under the process
+    # backend they run in the pool, everything else stays in this process.
+    executor = make_executor('process', args.workers) if args.backend == 'process' else None
+
+    def cpu_stage(name, fn, on_drop, batched=False):
+        return Stage(name, fn, stage_workers(args, name, args.workers), executor=executor,
+                     batch_size=args.chunk_size, on_drop=on_drop, batched=batched)
+
+    # A recording is journaled once each of its segments has been written or
+    # filtered out by some stage; one with a segment that failed to slice is
+    # left out so --resume retries it. Every item carries its audio path.
+    def parse(recording):
+        segments = parse_recording(recording, malformed)
+        journal.expect(source_key(recording[1], INPUT_DIR), len(segments))
+        return segments
+
+    def slice_failed(item):
+        # The segment's earlier clip was claimed but not rewritten.
+        sink.prune = False
+        journal.segment_failed(source_key(item[1], INPUT_DIR))
+
+    def write(item):
+        entry = write_segment(sink, item)
+        journal.segment_done(source_key(item[1], INPUT_DIR), entry)
+        progress.update()
+
+    pipeline = Pipeline(
+        [
+            Stage('parse', parse, stage_workers(args, 'parse', 1), fan_out=True),
+            cpu_stage('normalize', normalize_segments,
+                      lambda item: journal.segment_done(source_key(item[0], INPUT_DIR)), batched=True),
+            Stage('claim', lambda item: item if sink.claim(item[0]) else None,
+                  on_drop=lambda item: journal.segment_done(source_key(item[1], INPUT_DIR), {'id': item[0]})),
+            cpu_stage('slice', functools.partial(slice_segment, virtual=sink.virtual), slice_failed),
+            Stage('encode', encode_segment, stage_workers(args, 'encode', 2)),
+            Stage('write', write, stage_workers(args, 'write', 1)),
+        ],
+        args.queue_size,
+        inline=args.backend == 'serial',
+    )
+    recordings = (
+        r for r in iter_recordings(folders)
+        if not journal.is_done(source_key(r[1], INPUT_DIR))
+    )
+    try:
+        pipeline.run(recordings)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    progress.close()
+    journal.close()
+    sink.close()
+    if ATCC_TEXT_CLEANER.cache.persist:
+        ATCC_TEXT_CLEANER.cache.save()
+    for path, offset, reason in malformed:
+        print(f'Skipped malformed block in {path} at byte {offset}: {reason}', file=sys.stderr)
+    print(f'Normalization cache: {ATCC_TEXT_CLEANER.cache.stats()}')
+    print(f'Segment index: {segment_index_stats()}')
+    print(f'Pipeline: {pipeline.stats()}')
+    print(f'Skipped {sink.skipped} segments already on disk.')
     print('ATCC dataset processing completed.')
 
 
@@ -1,100 +1,144 @@
 import os
-import random
-import uuid
-import re
+import argparse
 import xml.etree.ElementTree as ET
-import soundfile as sf
-from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
-from utils import atco2_general_corrections
-
-RANDOM_SEED = 42
-random.seed(RANDOM_SEED)
+from normalization import add_cache_arguments, enable_persistence
+from executors import add_executor_arguments, imap_chunked, make_executor
+from output_sink import add_sink_arguments, bind_sink, open_sink, replay_calls
+from run_journal import RunJournal, add_resume_argument
+from segment_ids import segment_id
+from segment_index import open_segment_index, segment_index_stats
+from atco2_text import ATCO2_TEXT_CACHE, normalize_transmission
+from wav_memmap import WavMemmap
 
 INPUT_DIR = 'ATCO2_Raw_Data'
 DATASET_DIR = 'ATCO2_Dataset'
-AUDIO_OUTPUT_DIR = os.path.join(DATASET_DIR, 'audios')
-TEXT_OUTPUT_DIR = os.path.join(DATASET_DIR, 'texts')
-
-os.makedirs(AUDIO_OUTPUT_DIR, exist_ok=True)
-os.makedirs(TEXT_OUTPUT_DIR, exist_ok=True)
-
-TAGS_REMOVE = [
-    r'\[#command\]', r'\[/#command\]', r'\[#value\]', r'\[/#value\]',
-    r'\[#unnamed\]', r'\[/#unnamed\]', r'\[#callsign\]', r'\[/#callsign\]',
-    r'\[hes\]', r'\[HES\]', r'\[noise\]',
-]
 
-EXCLUDE_IF_CONTAINS = [
-    r'\[NE Czech\]', r'\[/NE\]', r'\[NE Slovak\]', r'\[Ne Czech\]',
-    r'\[/Ne\]', r'\[Ne Slovak\]', r'\[#nonenglish\]', r'\[/#nonenglish\]',
-    r'\[ukn\]', r'\[spk\]', r'\[xt\]', r'[\(\)]',
-]
+SEGMENT_PARSER_VERSION = 'atco2-xml-1'
 
 
-def deterministic_uuid():
-    return uuid.UUID(int=random.getrandbits(128))
-
-
-def clean_transcript(text):
-    if any(re.search(tag, text, re.IGNORECASE) for tag in EXCLUDE_IF_CONTAINS):
-        return None
-    for tag in TAGS_REMOVE:
-        text = re.sub(tag, '', text, flags=re.IGNORECASE)
-    for wrong, correct in atco2_general_corrections.items():
-        pattern = re.compile(rf'\b{re.escape(wrong)}\b', re.IGNORECASE)
-        text = pattern.sub(correct, text)
-    cleaned = re.sub(r'\s{2,}', ' ', text.strip()).upper()
-    return cleaned or None
+def iter_segments(xml_path, require_english=True, require_correct=True):
+    # Streams (start, end, raw_text) for each <segment> that passes the tag
+    # filters. Every element is detached from its parent once handled (a
+    # segment after it is read, anything outside a segment when it ends), so
+    # memory stays flat for XML files of any size and nesting.
+    stack = []
+    open_segments = 0
+    for event, elem in ET.iterparse(xml_path, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            open_segments += elem.tag == 'segment'
+            continue
+        stack.pop()
+        if elem.tag != 'segment':
+            if not open_segments and stack:
+                stack[-1].remove(elem)
+            continue
+        open_segments -= 1
+        try:
+            tags = elem.find('tags')
+            if tags is None:
+                continue
+            if require_english and tags.findtext('non_english') != '0':
+                continue
+            if require_correct and tags.findtext('correct_transcript') != '1':
+                continue
+            try:
+                start = float(elem.findtext('start'))
+                end = float(elem.findtext('end'))
+            except (TypeError, ValueError):
+                continue
+            yield start, end, elem.findtext('text', '')
+        finally:
+            elem.clear()
+            if stack:
+                stack[-1].remove(elem)
 
 
-def process_file(filename):
+def process_file(filename, sink):
+    # Returns the source's journal key and its segment entries, or None for
+    # the entries when the file or any of its segments failed, or its audio
+    # is missing; it is then retried on resume and nothing is pruned.
+    base = os.path.splitext(filename)[0]
     xml_path = os.path.join(INPUT_DIR, filename)
     wav_path = os.path.join(INPUT_DIR, filename.replace('.xml', '.wav'))
     if not os.path.exists(wav_path):
-        return
+        return base, None
+    audio = None
+    entries = []
+    failed = False
     try:
-        audio_data, sample_rate = sf.read(wav_path)
-        tree = ET.parse(xml_path)
-    except Exception:
-        return
-    root = tree.getroot()
-    for segment in root.findall('segment'):
-        tags = segment.find('tags')
-        if tags is None:
-            continue
-        if tags.findtext('non_english') != '0' or tags.findtext('correct_transcript') != '1':
-            continue
-        try:
-            start = float(segment.findtext('start'))
-            end = float(segment.findtext('end'))
-            raw_text = segment.findtext('text', '').strip()
-            if not raw_text or end <= start:
+        segments = open_segment_index(INPUT_DIR).segments(
+            'atco2', xml_path, wav_path, iter_segments, SEGMENT_PARSER_VERSION
+        )
+        for start, end, raw_text in segments:
+            if end <= start:
                 continue
-            cleaned_text = clean_transcript(raw_text)
+            cleaned_text, _ = normalize_transmission(raw_text)
             if not cleaned_text:
                 continue
-            start_sample = int(start * sample_rate)
-            end_sample = int(end * sample_rate)
-            segment_audio = audio_data[start_sample:end_sample]
-            uid = deterministic_uuid().hex.upper()[:20]
-            sf.write(os.path.join(AUDIO_OUTPUT_DIR, f'{uid}.wav'), segment_audio, sample_rate)
-            with open(os.path.join(TEXT_OUTPUT_DIR, f'{uid}.txt'), 'w', encoding='utf-8') as f:
-                f.write(cleaned_text)
-        except Exception:
-            continue
+            uid = segment_id('atco2', base, start, end, cleaned_text)
+            if not sink.claim(uid):
+                entries.append({'id': uid})
+                continue
+            if audio is None:
+                audio = WavMemmap(wav_path)
+            try:
+                if sink.virtual:
+                    entries.append(sink.write_segment(
+                        uid, cleaned_text, wav_path, *audio.frame_range(start, end), audio.sample_rate
+                    ))
+                else:
+                    entries.append(sink.write(
+                        uid,
+                        text=cleaned_text,
+                        samples=audio.slice(start, end),
+                        sample_rate=audio.sample_rate,
+                    ))
+            except Exception:
+                failed = True
+    except Exception:
+        return base, None
+    return base, None if failed else entries
 
 
 def main():
-    xml_files = [f for f in os.listdir(INPUT_DIR) if f.endswith('.xml')]
-    with ThreadPoolExecutor(max_workers=20) as executor:
-        list(
-            tqdm(
-                executor.map(process_file, xml_files),
-                total=len(xml_files),
-                desc='Processing Dataset',
-            )
-        )
+    parser = argparse.ArgumentParser(description='Process the ATCO2 test subset into clips and transcripts.')
+    add_sink_arguments(parser, virtual=True)
+    add_executor_arguments(parser, default_workers=20)
+    add_resume_argument(parser)
+    add_cache_arguments(parser)
+    args = parser.parse_args()
+    if args.persist_cache:
+        enable_persistence()
+    sink = open_sink(DATASET_DIR, args.output_format, max_shard_bytes=args.shard_size_mb << 20,
+                     resume=args.resume, prune=args.prune)
+    journal = RunJournal(DATASET_DIR, args.resume, sink)
+    if args.resume:
+        sink.restore(journal.segments())
+    xml_files = [
+        f for f in os.listdir(INPUT_DIR)
+        if f.endswith('.xml') and not journal.is_done(os.path.splitext(f)[0])
+    ]
+    task = bind_sink(process_file, sink, args.backend)
+    with make_executor(args.backend, args.workers) as executor:
+        for (base, entries), calls in tqdm(
+            imap_chunked(executor, task, ((f,) for f in xml_files), args.chunk_size),
+            total=len(xml_files),
+            desc='Processing Dataset',
+        ):
+            replay_calls(sink, calls)
+            if entries is None:
+                sink.prune = False
+            else:
+                journal.record(base, entries)
+    journal.close()
+    sink.close()
+    if ATCO2_TEXT_CACHE.persist:
+        ATCO2_TEXT_CACHE.save()
+    print(f'Normalization cache: {ATCO2_TEXT_CACHE.stats()}')
+    print(f'Segment index: {segment_index_stats()}')
+    print(f'Skipped {sink.skipped} segments already on disk.')
     print('ATCO2 dataset processing completed.')
 
 
@@ -1,267 +1,142 @@
 import os
 import re
-import random
-import string
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from pydub import AudioSegment
+import argparse
 from tqdm import tqdm
-from utils import (
-    uwb_general_corrections,
-    uwb_diacritics,
-    uwb_transmissions_to_specifically_exclude,
-    uwb_phonetic_mapping,
-    uwb_number_mapping,
-    uwb_tags_to_remove,
-    uwb_exclude_if_contains,
-)
-
-RANDOM_SEED = 42
-random.seed(RANDOM_SEED)
+from normalization import add_cache_arguments, enable_persistence
+from executors import add_executor_arguments, imap_chunked, make_executor
+from output_sink import add_sink_arguments, bind_sink, open_sink, replay_calls
+from run_journal import RunJournal, add_resume_argument
+from segment_ids import segment_id
+from segment_index import open_segment_index, segment_index_stats
+from uwb_text import UWB_TEXT_CACHE, excluded_transmissions, normalize_transmission
+from wav_memmap import WavMemmap
 
 INPUT_DIR = 'UWB_Raw_Data'
 DATASET_DIR = 'UWB_Dataset'
-AUDIO_OUTPUT_DIR = os.path.join(DATASET_DIR, 'audios')
-TEXT_OUTPUT_DIR = os.path.join(DATASET_DIR, 'texts')
-
-os.makedirs(AUDIO_OUTPUT_DIR, exist_ok=True)
-os.makedirs(TEXT_OUTPUT_DIR, exist_ok=True)
-
-COMPILED_TAGS_REMOVE = [re.compile(p, re.IGNORECASE) for p in uwb_tags_to_remove]
-COMPILED_EXCLUSION = [re.compile(p, re.IGNORECASE) for p in uwb_exclude_if_contains]
-
-
-def generate_uid(length=20):
-    chars = string.ascii_uppercase + string.digits
-    return ''.join(random.choices(chars, k=length))
-
-
-def replace_phonetic(m):
-    l = m.group(1).upper()
-    return uwb_phonetic_mapping.get(l, l)
-
-
-def convert_atc_text(text):
-    text = re.sub(
-        r'(?<=\s)([b-hj-zB-HJ-Z])(?=\s)',
-        replace_phonetic,
-        f' {text} ',
-    ).strip()
-    for k, v in uwb_general_corrections.items():
-        text = re.sub(rf'\b{re.escape(k)}\b', v, text, flags=re.IGNORECASE)
-    tokens = text.split()
-    out = []
-    i = 0
-    nato = set(uwb_phonetic_mapping.values())
-    triggers = {
-        'CONFIRM',
-        'REQUEST',
-        'DESCEND',
-        'CLIMB',
-        'MAINTAIN',
-        'CLEARED',
-        'CONTACT',
-        'REPORT',
-        'BACKTRACK',
-        'LINE',
-        'UP',
-        'DOWN',
-        'IDENT',
-        'SQUAWK',
-        'COPY',
-        'ROGER',
-        'WILCO',
-        'ACKNOWLEDGE',
-        'DEPART',
-        'APPROACH',
-    }
-    while i < len(tokens):
-        t = tokens[i]
-        if (
-            len(t) == 1
-            and t.isalpha()
-            and t.isupper()
-            and i + 2 < len(tokens)
-            and tokens[i + 1].upper() == 'AND'
-            and len(tokens[i + 2]) == 1
-            and tokens[i + 2].isalpha()
-            and tokens[i + 2].isupper()
-        ):
-            out.extend(
-                [
-                    uwb_phonetic_mapping[t],
-                    'AND',
-                    uwb_phonetic_mapping[tokens[i + 2]]
-                    if tokens[i + 2] != 'I'
-                    else 'I',
-                ]
-            )
-            i += 3
-            continue
-        if (
-            t.upper() == 'AND'
-            and i + 1 < len(tokens)
-            and len(tokens[i + 1]) == 1
-            and tokens[i + 1].isalpha()
-            and tokens[i + 1].isupper()
-        ):
-            out.append('AND')
-            out.append(
-                uwb_phonetic_mapping[tokens[i + 1]]
-                if tokens[i + 1] != 'I'
-                else 'I'
-            )
-            i += 2
-            continue
-        if t == 'FL':
-            out.append('FLIGHT LEVEL')
-        elif t in uwb_number_mapping:
-            out.append(uwb_number_mapping[t])
-        elif len(t) == 1 and t.isalpha() and t.isupper():
-            nxt = (
-                i < len(tokens) - 1
-                and (
-                    (
-                        len(tokens[i + 1]) == 1
-                        and tokens[i + 1].isalpha()
-                        and tokens[i + 1].isupper()
-                    )
-                    or tokens[i + 1].isdigit()
-                    or tokens[i + 1] in nato
-                    or tokens[i + 1] in triggers
-                )
-            )
-            prev = (
-                i > 0
-                and (
-                    (
-                        len(tokens[i - 1]) == 1
-                        and tokens[i - 1].isalpha()
-                        and tokens[i - 1].isupper()
-                    )
-                    or tokens[i - 1].isdigit()
-                    or tokens[i - 1] in nato
-                )
-            )
-            if i == 0:
-                out.append(
-                    uwb_phonetic_mapping[t]
-                    if nxt
-                    else (t if t == 'I' else uwb_phonetic_mapping.get(t, t))
-                )
-            else:
-                out.append(uwb_phonetic_mapping[t] if prev or nxt else t)
-        else:
-            out.append(t)
-        i += 1
-    if out and len(out[-1]) == 1 and out[-1].isalpha() and out[-1].isupper():
-        out[-1] = uwb_phonetic_mapping[out[-1]]
-    return ' '.join(out)
-
 
-def clean_text(text):
-    for d, r in uwb_diacritics.items():
-        text = text.replace(d, r)
-    for p in COMPILED_EXCLUSION:
-        if p.search(text):
-            return text, True
-    t = text
-    for p in COMPILED_TAGS_REMOVE:
-        t = p.sub(' ', t)
-    t = re.sub(r'\.{2,}', ' ', t)
-    t = t.replace('?', '')
-    t = re.sub(r'[^\w\s.]', '', t)
-    t = re.sub(r'(?<=\d)\.(?=\s|$)', ' .', t)
-    t = re.sub(r'\s+', ' ', t).strip().upper()
-    return convert_atc_text(t), False
-
-
-SYNC_PATTERN = re.compile(r'<Sync time="([\d.]+)"/>\s*([^<]*)')
-
-normalized_excluded = {
-    clean_text(
-        re.sub(
-            r'(?<=[0-9])(?=[A-Za-z])',
-            ' ',
-            re.sub(
-                r'(?<=[A-Za-z])(?=[0-9])',
-                ' ',
-                t,
-            ),
-        )
-    )[0].strip().upper()
-    for t in uwb_transmissions_to_specifically_exclude
-    if clean_text(
-        re.sub(
-            r'(?<=[0-9])(?=[A-Za-z])',
-            ' ',
-            re.sub(
-                r'(?<=[A-Za-z])(?=[0-9])',
-                ' ',
-                t,
-            ),
-        )
-    )[0]
-}
-strict_exclusions = {
-    s.strip().upper() for s in uwb_transmissions_to_specifically_exclude
-}
-
-
-def process_file(filename):
+TRS_TOKEN_PATTERN = re.compile(
+    r'<Sync time="([\d.]+)"/>\s*([^<]*)|<Turn\b[^>]*?\bendTime="([\d.]+)"[^>]*>'
+)
+TRS_CHUNK_SIZE = 1 << 16
+TRS_PARSER_VERSION = 'uwb-trs-2'
+
+
+def iter_trs_segments(path, chunk_size=TRS_CHUNK_SIZE):
+    # Streams (start, end, raw_text) in seconds from a Transcriber .trs file.
+    # Each <Sync> is closed by the next one, as before; the last one in the
+    # file is closed by its enclosing <Turn endTime> rather than dropped.
+    # Only text up to the last '<' read so far is scanned, so no tag or
+    # Sync text is ever split across chunks.
+    pending = None
+    turn_end = None
+    buf = ''
+    with open(path, encoding='cp1250') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            buf += chunk
+            cut = buf.rfind('<') if chunk else len(buf)
+            if cut <= 0 and chunk:
+                continue
+            for m in TRS_TOKEN_PATTERN.finditer(buf, 0, cut):
+                if m.group(3) is not None:
+                    turn_end = float(m.group(3))
+                    continue
+                t = float(m.group(1))
+                if pending is not None:
+                    yield pending[0], t, pending[1]
+                pending = (t, m.group(2))
+            buf = buf[cut:]
+            if not chunk:
+                break
+    if pending is not None and turn_end is not None and turn_end > pending[0]:
+        yield pending[0], turn_end, pending[1]
+
+def process_file(filename, sink):
+    # Returns the source's journal key and its segment entries, or None for
+    # the entries when the file or any of its segments failed, or its audio
+    # is missing; it is then retried on resume and nothing is pruned.
     base = os.path.splitext(filename)[0]
     trs_path = os.path.join(INPUT_DIR, f'{base}.trs')
     wav_path = os.path.join(INPUT_DIR, f'{base}.wav')
     if not os.path.exists(wav_path):
-        return []
-    try:
-        content = open(trs_path, encoding='cp1250').read()
-    except Exception:
-        return []
-    matches = SYNC_PATTERN.findall(content)
-    if not matches:
-        return []
+        return base, None
+    audio = None
+    entries = []
+    failed = False
     try:
-        audio = AudioSegment.from_wav(wav_path)
+        segments = open_segment_index(INPUT_DIR).segments(
+            'uwb', trs_path, wav_path, iter_trs_segments, TRS_PARSER_VERSION
+        )
+        for start_s, end_s, raw in segments:
+            cleaned, _ = normalize_transmission(raw)
+            if cleaned is None:
+                continue
+            uid = segment_id('uwb', base, start_s, end_s, cleaned)
+            if not sink.claim(uid):
+                entries.append({'id': uid})
+                continue
+            if audio is None:
+                audio = WavMemmap(wav_path)
+            try:
+                if sink.virtual:
+                    entries.append(sink.write_segment(
+                        uid, cleaned, wav_path, *audio.frame_range(start_s, end_s), audio.sample_rate
+                    ))
+                else:
+                    entries.append(sink.write(
+                        uid,
+                        text=cleaned,
+                        samples=audio.slice(start_s, end_s),
+                        sample_rate=audio.sample_rate,
+                    ))
+            except Exception:
+                failed = True
     except Exception:
-        return []
-    results = []
-    for i in range(len(matches) - 1):
-        start = float(matches[i][0]) * 1000
-        end = float(matches[i + 1][0]) * 1000
-        raw = matches[i][1].strip()
-        if not raw or not re.search(r'[^ .\n]', raw):
-            continue
-        cleaned, excl = clean_text(raw)
-        cu = cleaned.strip().upper()
-        if excl or not cu or cu in normalized_excluded or cu in strict_exclusions:
-            continue
-        uid = generate_uid()
-        try:
-            audio[start:end].export(
-                os.path.join(AUDIO_OUTPUT_DIR, f'{uid}.wav'), format='wav'
-            )
-            with open(
-                os.path.join(TEXT_OUTPUT_DIR, f'{uid}.txt'),
-                'w',
-                encoding='utf-8',
-            ) as f:
-                f.write(cleaned)
-            results.append(cleaned)
-        except Exception:
-            continue
-    return results
+        return base, None
+    return base, None if failed else entries
+
+
+def init_worker():
+    excluded_transmissions()
 
 
 def main():
-    trs_files = [f for f in os.listdir(INPUT_DIR) if f.endswith('.trs')]
-    with ThreadPoolExecutor(max_workers=20) as executor:
-        futures = {executor.submit(process_file, f): f for f in trs_files}
-        for _ in tqdm(
-            as_completed(futures),
-            total=len(futures),
+    parser = argparse.ArgumentParser(description='Process the UWB ATC corpus into clips and transcripts.')
+    add_sink_arguments(parser, virtual=True)
+    add_executor_arguments(parser, default_workers=20)
+    add_resume_argument(parser)
+    add_cache_arguments(parser)
+    args = parser.parse_args()
+    if args.persist_cache:
+        enable_persistence()
+    sink = open_sink(DATASET_DIR, args.output_format, max_shard_bytes=args.shard_size_mb << 20,
+                     resume=args.resume, prune=args.prune)
+    journal = RunJournal(DATASET_DIR, args.resume, sink)
+    if args.resume:
+        sink.restore(journal.segments())
+    trs_files = [
+        f for f in os.listdir(INPUT_DIR)
+        if f.endswith('.trs') and not journal.is_done(os.path.splitext(f)[0])
+    ]
+    task = bind_sink(process_file, sink, args.backend)
+    with make_executor(args.backend, args.workers, init_worker) as executor:
+        for (base, entries), calls in tqdm(
+            imap_chunked(executor, task, ((f,) for f in trs_files), args.chunk_size),
+            total=len(trs_files),
             desc='Processing Dataset',
         ):
-            pass
+            replay_calls(sink, calls)
+            if entries is None:
+                sink.prune = False
+            else:
+                journal.record(base, entries)
+    journal.close()
+    sink.close()
+    if UWB_TEXT_CACHE.persist:
+        UWB_TEXT_CACHE.save()
+    print(f'Normalization cache: {UWB_TEXT_CACHE.stats()}')
+    print(f'Segment index: {segment_index_stats()}')
+    print(f'Skipped {sink.skipped} segments already on disk.')
     print('UWB dataset processing completed.')
 
 
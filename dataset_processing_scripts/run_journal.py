@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import threading
+
+JOURNAL_NAME = '.journal.jsonl'
+JOURNAL_FLUSH_RECORDS = 64
+JOURNAL_FLUSH_SECONDS = 5.0
+
+
+def read_journal(path):
+    # A run killed mid-append leaves a truncated last line; it is dropped,
+    # so that source simply counts as unfinished.
+    done = {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                done[record['source']] = record['segments']
+    except FileNotFoundError:
+        pass
+    return done
+
+
+class RunJournal:
+    # Append-only JSONL record of the source files a run has finished, one
+    # line per source listing the segments it emitted. Lines are batched and
+    # fsynced together, after flushing the sink, so a source is only ever
+    # journaled once its output is on disk. With resume, finished sources
+    # are loaded back for the run to skip.
+
+    def __init__(self, root, resume=False, sink=None):
+        os.makedirs(root, exist_ok=True)
+        self.path = os.path.join(root, JOURNAL_NAME)
+        self.sink = sink
+        self.done = read_journal(self.path) if resume else {}
+        # Rewrite what was read, so appends never follow a truncated line.
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for source, segments in self.done.items():
+                f.write(json.dumps({'source': source, 'segments': segments}, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._f = open(self.path, 'a', encoding='utf-8')
+        self._pending = []
+        self._outstanding = {}
+        self._failed = set()
+        self._last_commit = time.monotonic()
+        self._lock = threading.Lock()
+
+    def is_done(self, source):
+        return source in self.done
+
+    def segments(self):
+        return [s for segments in self.done.values() for s in segments]
+
+    def record(self, source, segments):
+        with self._lock:
+            self.done[source] = segments
+            self._pending.append(json.dumps({'source': source, 'segments': segments}, ensure_ascii=False))
+            due = (len(self._pending) >= JOURNAL_FLUSH_RECORDS
+                   or time.monotonic() - self._last_commit >= JOURNAL_FLUSH_SECONDS)
+            if due:
+                self._commit()
+
+    def expect(self, source, count):
+        # For sources whose segments finish one by one (ATCC's pipeline):
+        # the source is recorded once `count` calls to segment_done arrive.
+        if count == 0:
+            self.record(source, [])
+            return
+        with self._lock:
+            self._outstanding[source] = [count, []]
+
+    def segment_failed(self, source):
+        # The source is never recorded, so a resumed run retries it.
+        with self._lock:
+            self._outstanding.pop(source, None)
+            self._failed.add(source)
+
+    def segment_done(self, source, segment=None):
+        with self._lock:
+            if source in self._failed:
+                return
+            entry = self._outstanding[source]
+            entry[0] -= 1
+            if segment is not None:
+                entry[1].append(segment)
+            finished = entry[0] == 0
+            if finished:
+                del self._outstanding[source]
+        if finished:
+            self.record(source, entry[1])
+
+    def _commit(self):
+        if self._pending:
+            if self.sink is not None:
+                self.sink.flush()
+            self._f.write('\n'.join(self._pending) + '\n')
+            self._f.flush()
+            os.fsync(self._f.fileno())
+            self._pending = []
+        self._last_commit = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            self._commit()
+            self._f.close()
+
+
+def add_resume_argument(parser):
+    parser.add_argument('--resume', action='store_true',
+                        help=f'Skip source files a previous run recorded as finished in {JOURNAL_NAME}.')
@@ -0,0 +1,29 @@
+import os
+import string
+import hashlib
+
+ID_LENGTH = 20
+ID_ALPHABET = string.ascii_uppercase + string.digits
+ID_SCHEME = 'seg-1'
+
+
+def content_id(*parts, length=ID_LENGTH):
+    # Stable base-36 digest of the parts: the same inputs give the same ID in
+    # every run, whatever the backend or worker count.
+    key = '\x1f'.join((ID_SCHEME,) + tuple(str(p) for p in parts))
+    n = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest(), 'big')
+    chars = []
+    for _ in range(length):
+        n, r = divmod(n, len(ID_ALPHABET))
+        chars.append(ID_ALPHABET[r])
+    return ''.join(chars)
+
+
+def source_key(path, root):
+    # Recording path relative to the corpus root, without extension, so an
+    # ID survives moving the corpus and transcoding .sph to .wav.
+    return os.path.splitext(os.path.relpath(path, root))[0].replace(os.sep, '/')
+
+
+def segment_id(corpus, source, start_s, end_s, text):
+    return content_id(corpus, source, f'{start_s:.3f}', f'{end_s:.3f}', text.strip())
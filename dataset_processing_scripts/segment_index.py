@@ -0,0 +1,214 @@
+import os
+import wave
+import sqlite3
+import hashlib
+import threading
+
+from executors import add_worker_reporter
+
+SEGMENT_INDEX_NAME = '.segment_index.sqlite'
+HASH_CHUNK_SIZE = 1 << 20
+INSERT_BATCH_SIZE = 512
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    corpus TEXT NOT NULL,
+    parser_version TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha1 TEXT NOT NULL,
+    audio_path TEXT,
+    audio_size INTEGER,
+    audio_mtime_ns INTEGER,
+    sample_rate INTEGER,
+    channels INTEGER,
+    sample_width INTEGER,
+    frames INTEGER
+);
+CREATE TABLE IF NOT EXISTS segments (
+    path TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    start REAL NOT NULL,
+    end REAL NOT NULL,
+    start_sample INTEGER,
+    end_sample INTEGER,
+    raw_text TEXT NOT NULL,
+    PRIMARY KEY (path, seq)
+);
+'''
+
+
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def wav_header(path):
+    try:
+        with wave.open(path, 'rb') as w:
+            return w.getframerate(), w.getnchannels(), w.getsampwidth(), w.getnframes()
+    except (OSError, EOFError, wave.Error):
+        return None, None, None, None
+
+
+class SegmentIndex:
+    # Persistent cache of parsed raw transcripts. A transcript is re-parsed
+    # only when its size/mtime change *and* its content hash differs, or
+    # when the corpus parser version changes; the audio header is refreshed
+    # whenever the paired audio file changes. On a miss, segments() streams
+    # the parse instead of returning a list.
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+    def segments(self, corpus, transcript_path, audio_path, parse, parser_version='1'):
+        key = os.path.abspath(transcript_path)
+        st = os.stat(transcript_path)
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT parser_version, size, mtime_ns, sha1, audio_size, audio_mtime_ns '
+                'FROM files WHERE path = ?',
+                (key,),
+            ).fetchone()
+        sha1 = None
+        fresh = False
+        if row and row[0] == parser_version:
+            if (row[1], row[2]) == (st.st_size, st.st_mtime_ns):
+                fresh = True
+            else:
+                sha1 = file_sha1(transcript_path)
+                fresh = sha1 == row[3]
+        audio_st = os.stat(audio_path) if audio_path and os.path.exists(audio_path) else None
+        audio_key = (audio_st.st_size, audio_st.st_mtime_ns) if audio_st else (None, None)
+        if fresh:
+            with self._lock:
+                if sha1 is not None:
+                    self._conn.execute(
+                        'UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?',
+                        (st.st_size, st.st_mtime_ns, key),
+                    )
+                if (row[4], row[5]) != audio_key:
+                    self._store_audio(key, audio_path, audio_key)
+                rows = self._conn.execute(
+                    'SELECT start, end, raw_text FROM segments WHERE path = ? ORDER BY seq',
+                    (key,),
+                ).fetchall()
+                self._conn.commit()
+            count('reused')
+            return rows
+        return self._parse(corpus, key, transcript_path, audio_path, audio_key, st, sha1, parse,
+                           parser_version)
+
+    def _parse(self, corpus, key, transcript_path, audio_path, audio_key, st, sha1, parse,
+               parser_version):
+        # Yields segments as the parser produces them, storing them in
+        # batches. The files row is written only once parsing finished, so a
+        # parse abandoned halfway is redone next time.
+        with self._lock:
+            self._conn.execute('DELETE FROM files WHERE path = ?', (key,))
+            self._conn.execute('DELETE FROM segments WHERE path = ?', (key,))
+            self._conn.commit()
+        batch = []
+        seq = 0
+        for s, e, raw in parse(transcript_path):
+            record = (float(s), float(e), raw)
+            batch.append((key, seq, *record))
+            seq += 1
+            if len(batch) >= INSERT_BATCH_SIZE:
+                self._insert(batch)
+                batch = []
+            yield record
+        self._insert(batch)
+        sha1 = sha1 or file_sha1(transcript_path)
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO files (path, corpus, parser_version, size, mtime_ns, sha1) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, corpus, parser_version, st.st_size, st.st_mtime_ns, sha1),
+            )
+            self._store_audio(key, audio_path, audio_key)
+            self._conn.commit()
+        count('parsed')
+
+    def _insert(self, batch):
+        # Sample positions are filled in by _store_audio once the audio
+        # header is known.
+        with self._lock:
+            self._conn.executemany(
+                'INSERT INTO segments (path, seq, start, end, raw_text) VALUES (?, ?, ?, ?, ?)',
+                batch,
+            )
+            self._conn.commit()
+
+    def _store_audio(self, key, audio_path, audio_key):
+        header = wav_header(audio_path) if audio_key[0] is not None else (None,) * 4
+        self._conn.execute(
+            'UPDATE files SET audio_path = ?, audio_size = ?, audio_mtime_ns = ?, '
+            'sample_rate = ?, channels = ?, sample_width = ?, frames = ? WHERE path = ?',
+            (audio_path and os.path.abspath(audio_path), *audio_key, *header, key),
+        )
+        sample_rate = header[0]
+        self._conn.execute(
+            'UPDATE segments SET start_sample = CAST(start * ? AS INTEGER), '
+            'end_sample = CAST(end * ? AS INTEGER) WHERE path = ?',
+            (sample_rate, sample_rate, key),
+        )
+        return sample_rate
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+_counts = {'parsed': 0, 'reused': 0}
+_counts_lock = threading.Lock()
+
+
+def open_segment_index(directory):
+    # One index per input directory, kept next to the raw transcripts it
+    # describes.
+    db_path = os.path.join(directory, SEGMENT_INDEX_NAME)
+    with _indexes_lock:
+        key = (os.getpid(), os.path.abspath(db_path))
+        if key not in _indexes:
+            _indexes[key] = SegmentIndex(db_path)
+        return _indexes[key]
+
+
+def count(name):
+    with _counts_lock:
+        _counts[name] += 1
+
+
+def drain_stats():
+    with _counts_lock:
+        report = dict(_counts)
+        for name in _counts:
+            _counts[name] = 0
+    return report
+
+
+def merge_stats(report):
+    with _counts_lock:
+        for name, n in report.items():
+            _counts[name] += n
+
+
+def segment_index_stats():
+    # Parsed/reused transcript counts for this run, including those from
+    # process-pool workers.
+    with _counts_lock:
+        return dict(_counts)
+
+
+add_worker_reporter('segment_index', drain_stats, merge_stats)
@@ -0,0 +1,95 @@
+import os
+import json
+import functools
+import numpy as np
+from sphere import SphereReader
+from wav_memmap import WavMemmap
+
+SEGMENT_MANIFEST_NAME = 'segments'
+MANIFEST_FORMATS = ('jsonl', 'parquet')
+MANIFEST_FIELDS = ('id', 'source_path', 'start_sample', 'end_sample', 'sample_rate', 'text')
+MAX_OPEN_SOURCES = 16
+
+
+def manifest_path(root, fmt='jsonl'):
+    return os.path.join(root, f'{SEGMENT_MANIFEST_NAME}.{fmt}')
+
+
+def find_manifest(root):
+    for fmt in MANIFEST_FORMATS:
+        path = manifest_path(root, fmt)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def write_segment_manifest(path, records):
+    tmp_path = f'{path}.tmp'
+    if path.endswith('.parquet'):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError('Parquet manifests need pyarrow (pip install pyarrow)')
+        columns = {k: [r[k] for r in records] for k in MANIFEST_FIELDS}
+        pq.write_table(pa.table(columns), tmp_path)
+    else:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for r in records:
+                f.write(json.dumps(r, ensure_ascii=False) + '\n')
+    os.replace(tmp_path, path)
+
+
+def read_segment_manifest(path):
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        return pq.read_table(path).to_pylist()
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+@functools.lru_cache(maxsize=MAX_OPEN_SOURCES)
+def open_source(path):
+    return SphereReader(path) if path.endswith('.sph') else WavMemmap(path)
+
+
+def read_clip(record, target_sr=None, mono=True):
+    # Slices one segment out of its source recording on demand. Returns
+    # (int16 samples, sample_rate); with target_sr set, the clip is
+    # resampled to that rate.
+    source = open_source(record['source_path'])
+    audio = source.read(record['start_sample'], record['end_sample'])
+    sr = record['sample_rate']
+    if mono:
+        audio = audio[:, 0] if audio.shape[1] == 1 else audio.mean(axis=1).astype(np.int16)
+    if target_sr and target_sr != sr:
+        import resampy
+        resampled = resampy.resample(audio.astype(np.float32) / 32768, sr, target_sr, axis=0)
+        audio = np.clip(np.round(resampled * 32768), -32768, 32767).astype(np.int16)
+        sr = target_sr
+    return audio, sr
+
+
+class SegmentDataset:
+    # Manifest-aware loader: indexing returns a dict with the clip's id,
+    # text, sample_rate and audio, where audio is sliced from the source
+    # recording only when the item is requested.
+
+    def __init__(self, path, target_sr=None, mono=True):
+        if os.path.isdir(path):
+            path = find_manifest(path)
+        self.records = read_segment_manifest(path)
+        self.target_sr = target_sr
+        self.mono = mono
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, i):
+        record = self.records[i]
+        audio, sr = read_clip(record, self.target_sr, self.mono)
+        return {'id': record['id'], 'text': record['text'], 'sample_rate': sr, 'audio': audio}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
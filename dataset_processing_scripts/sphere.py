@@ -0,0 +1,76 @@
+import os
+import numpy as np
+
+SPHERE_MAGIC = b'NIST_1A'
+ULAW_CODINGS = ('ulaw', 'mu-law')
+
+
+def read_sphere_header(f):
+    if f.readline().strip() != SPHERE_MAGIC:
+        raise ValueError('not a NIST SPHERE file')
+    header_size = int(f.readline().strip())
+    f.seek(0)
+    fields = {'header_size': header_size}
+    for line in f.read(header_size).split(b'\n')[2:]:
+        parts = line.strip().split(None, 2)
+        if parts == [b'end_head']:
+            break
+        if len(parts) < 3:
+            continue
+        key, kind, value = parts
+        value = value.decode('ascii', 'replace')
+        if kind.startswith(b'-i'):
+            value = int(value)
+        elif kind.startswith(b'-r'):
+            value = float(value)
+        fields[key.decode('ascii', 'replace')] = value
+    return fields
+
+
+def ulaw_table():
+    u = ~np.arange(256, dtype=np.uint8)
+    magnitude = (((u & 0x0F).astype(np.int32) << 3) + 0x84) << ((u & 0x70) >> 4).astype(np.int32)
+    return np.where(u & 0x80, 0x84 - magnitude, magnitude - 0x84).astype(np.int16)
+
+
+ULAW_TABLE = ulaw_table()
+
+
+class SphereReader:
+    # Memory-mapped reader for uncompressed NIST SPHERE audio (16-bit PCM in
+    # either byte order, or 8-bit mu-law). Compressed files such as
+    # embedded-shorten raise ValueError so callers can fall back to ffmpeg.
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = read_sphere_header(f)
+        coding = str(header.get('sample_coding', 'pcm')).lower()
+        self.channels = header.get('channel_count', 1)
+        self.sample_rate = int(header['sample_rate'])
+        if coding == 'pcm':
+            width = header.get('sample_n_bytes', 2)
+            if width != 2:
+                raise ValueError(f'unsupported SPHERE sample width {width}')
+            dtype = '>i2' if header.get('sample_byte_format') == '10' else '<i2'
+        elif coding in ULAW_CODINGS:
+            width, dtype = 1, 'u1'
+        else:
+            raise ValueError(f'unsupported SPHERE sample coding {coding!r}')
+        self.ulaw = dtype == 'u1'
+        offset = header['header_size']
+        frames = (os.path.getsize(path) - offset) // (width * self.channels)
+        frames = min(frames, header.get('sample_count', frames))
+        self.data = np.memmap(
+            path, dtype=dtype, mode='r', offset=offset, shape=(frames, self.channels)
+        ) if frames > 0 else np.zeros((0, self.channels), dtype=dtype)
+
+    @property
+    def frames(self):
+        return self.data.shape[0]
+
+    def read(self, start, end):
+        block = self.data[start:end]
+        if self.ulaw:
+            return ULAW_TABLE[block]
+        return block.astype(np.int16)
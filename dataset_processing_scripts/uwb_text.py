@@ -0,0 +1,265 @@
+import re
+import functools
+import threading
+from utils import (
+    uwb_general_corrections,
+    uwb_diacritics,
+    uwb_transmissions_to_specifically_exclude,
+    uwb_phonetic_mapping,
+    uwb_number_mapping,
+    uwb_tags_to_remove,
+    uwb_exclude_if_contains,
+)
+from normalization import (
+    CorrectionEngine,
+    NormalizationCache,
+    fold_diacritics,
+    load_or_build_artifact,
+    rules_version,
+)
+
+COMPILED_TAGS_REMOVE = [re.compile(p, re.IGNORECASE) for p in uwb_tags_to_remove]
+EXCLUSION_LITERALS = tuple(p for p in uwb_exclude_if_contains if re.fullmatch(r'\w+', p))
+EXCLUSION_PATTERNS = [p for p in uwb_exclude_if_contains if p not in EXCLUSION_LITERALS]
+COMPILED_EXCLUSION_LITERALS = re.compile(
+    '|'.join(f'(?P<l{i}>{p})' for i, p in enumerate(EXCLUSION_LITERALS)), re.IGNORECASE
+)
+COMPILED_EXCLUSION_PATTERNS = re.compile(
+    '|'.join(f'(?P<p{i}>{p})' for i, p in enumerate(EXCLUSION_PATTERNS)), re.IGNORECASE
+)
+UWB_CORRECTIONS = CorrectionEngine(uwb_general_corrections)
+UWB_RULES_VERSION = rules_version(
+    uwb_general_corrections,
+    uwb_diacritics,
+    uwb_transmissions_to_specifically_exclude,
+    uwb_phonetic_mapping,
+    uwb_number_mapping,
+    uwb_tags_to_remove,
+    uwb_exclude_if_contains,
+)
+UWB_TEXT_CACHE = NormalizationCache('uwb_clean_text', UWB_RULES_VERSION)
+
+
+def replace_phonetic(m):
+    l = m.group(1).upper()
+    return uwb_phonetic_mapping.get(l, l)
+
+
+TRIGGER_WORDS = frozenset({
+    'CONFIRM',
+    'REQUEST',
+    'DESCEND',
+    'CLIMB',
+    'MAINTAIN',
+    'CLEARED',
+    'CONTACT',
+    'REPORT',
+    'BACKTRACK',
+    'LINE',
+    'UP',
+    'DOWN',
+    'IDENT',
+    'SQUAWK',
+    'COPY',
+    'ROGER',
+    'WILCO',
+    'ACKNOWLEDGE',
+    'DEPART',
+    'APPROACH',
+})
+NATO_WORDS = frozenset(uwb_phonetic_mapping.values())
+
+LETTER, AND, FL, NUMBER, DIGIT, NATO, TRIGGER = (1 << n for n in range(7))
+NEXT_CONTEXT = LETTER | DIGIT | NATO | TRIGGER
+PREV_CONTEXT = LETTER | DIGIT | NATO
+
+
+@functools.lru_cache(maxsize=65536)
+def classify_token(t):
+    cls = 0
+    if len(t) == 1 and t.isalpha() and t.isupper():
+        cls |= LETTER
+    if t.upper() == 'AND':
+        cls |= AND
+    if t == 'FL':
+        cls |= FL
+    if t in uwb_number_mapping:
+        cls |= NUMBER
+    if t.isdigit():
+        cls |= DIGIT
+    if t in NATO_WORDS:
+        cls |= NATO
+    if t in TRIGGER_WORDS:
+        cls |= TRIGGER
+    return cls
+
+
+def phonetic_or_i(t):
+    return uwb_phonetic_mapping[t] if t != 'I' else 'I'
+
+
+def expand_letter(tokens, classes, i, out):
+    t = tokens[i]
+    if i + 2 < len(tokens) and classes[i + 1] & AND and classes[i + 2] & LETTER:
+        out.extend([uwb_phonetic_mapping[t], 'AND', phonetic_or_i(tokens[i + 2])])
+        return 3
+    nxt = i < len(tokens) - 1 and classes[i + 1] & NEXT_CONTEXT
+    if i == 0:
+        out.append(
+            uwb_phonetic_mapping[t]
+            if nxt
+            else (t if t == 'I' else uwb_phonetic_mapping.get(t, t))
+        )
+    else:
+        prev = classes[i - 1] & PREV_CONTEXT
+        out.append(uwb_phonetic_mapping[t] if prev or nxt else t)
+    return 1
+
+
+def expand_and(tokens, classes, i, out):
+    if i + 1 < len(tokens) and classes[i + 1] & LETTER:
+        out.extend(['AND', phonetic_or_i(tokens[i + 1])])
+        return 2
+    out.append(tokens[i])
+    return 1
+
+
+def expand_fl(tokens, classes, i, out):
+    out.append('FLIGHT LEVEL')
+    return 1
+
+
+def expand_number(tokens, classes, i, out):
+    out.append(uwb_number_mapping[tokens[i]])
+    return 1
+
+
+# Checked in order against each token's class; the first matching bit picks
+# the transition. Tokens matching none are copied through unchanged.
+TOKEN_TRANSITIONS = (
+    (LETTER, expand_letter),
+    (AND, expand_and),
+    (FL, expand_fl),
+    (NUMBER, expand_number),
+)
+EXPANDABLE = LETTER | AND | FL | NUMBER
+
+
+def convert_atc_text(text):
+    text = re.sub(
+        r'(?<=\s)([b-hj-zB-HJ-Z])(?=\s)',
+        replace_phonetic,
+        f' {text} ',
+    ).strip()
+    return expand_tokens(UWB_CORRECTIONS(text))
+
+
+def expand_tokens(text):
+    tokens = text.split()
+    classes = [classify_token(t) for t in tokens]
+    out = []
+    i = 0
+    while i < len(tokens):
+        cls = classes[i]
+        if not cls & EXPANDABLE:
+            out.append(tokens[i])
+            i += 1
+            continue
+        for flag, transition in TOKEN_TRANSITIONS:
+            if cls & flag:
+                i += transition(tokens, classes, i, out)
+                break
+    if out and len(out[-1]) == 1 and out[-1].isalpha() and out[-1].isupper():
+        out[-1] = uwb_phonetic_mapping[out[-1]]
+    return ' '.join(out)
+
+
+def find_exclusion(text):
+    # Rules are case-insensitive substring matches (TEL also excludes HOTEL),
+    # so ASCII text can be checked with plain `in` against the upper-cased
+    # string; anything else goes through the IGNORECASE regex to keep
+    # Unicode case folding identical.
+    if text.isascii():
+        upper = text.upper()
+        for lit in EXCLUSION_LITERALS:
+            if lit.upper() in upper:
+                return lit
+    else:
+        m = COMPILED_EXCLUSION_LITERALS.search(text)
+        if m:
+            return EXCLUSION_LITERALS[int(m.lastgroup[1:])]
+    m = COMPILED_EXCLUSION_PATTERNS.search(text)
+    if m:
+        return EXCLUSION_PATTERNS[int(m.lastgroup[1:])]
+    return None
+
+
+def clean_text(text):
+    return UWB_TEXT_CACHE.get_or_compute(text, normalize_text)
+
+
+def normalize_text(text):
+    text = fold_diacritics(text)
+    if find_exclusion(text):
+        return text, True
+    return convert_atc_text(remove_tags(text)), False
+
+
+def remove_tags(t):
+    for p in COMPILED_TAGS_REMOVE:
+        t = p.sub(' ', t)
+    t = re.sub(r'\.{2,}', ' ', t)
+    t = t.replace('?', '')
+    t = re.sub(r'[^\w\s.]', '', t)
+    t = re.sub(r'(?<=\d)\.(?=\s|$)', ' .', t)
+    return re.sub(r'\s+', ' ', t).strip().upper()
+
+
+_excluded_lock = threading.Lock()
+_excluded = None
+
+
+def build_excluded_transmissions():
+    normalized = set()
+    for t in uwb_transmissions_to_specifically_exclude:
+        t = re.sub(r'(?<=[A-Za-z])(?=[0-9])', ' ', t)
+        t = re.sub(r'(?<=[0-9])(?=[A-Za-z])', ' ', t)
+        cleaned = clean_text(t)[0]
+        if cleaned:
+            normalized.add(cleaned.strip().upper())
+    strict = {s.strip().upper() for s in uwb_transmissions_to_specifically_exclude}
+    return sorted(normalized | strict)
+
+
+def excluded_transmissions():
+    global _excluded
+    if _excluded is None:
+        with _excluded_lock:
+            if _excluded is None:
+                _excluded = frozenset(
+                    load_or_build_artifact(
+                        'uwb_excluded_transmissions',
+                        UWB_RULES_VERSION,
+                        build_excluded_transmissions,
+                    )
+                )
+    return _excluded
+
+
+def is_excluded_transmission(text):
+    return text in excluded_transmissions()
+
+
+def normalize_transmission(raw):
+    raw = raw.strip()
+    if not raw or not re.search(r'[^ .\n]', raw):
+        return None, 'empty'
+    cleaned, excl = clean_text(raw)
+    if excl:
+        return None, 'excluded_rule'
+    cu = cleaned.strip().upper()
+    if not cu:
+        return None, 'empty'
+    if is_excluded_transmission(cu):
+        return None, 'excluded_transmission'
+    return cleaned, None
@@ -0,0 +1,84 @@
+import os
+import struct
+import numpy as np
+import soundfile as sf
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+PCM_SUBFORMAT_PREFIX = b'\x01\x00'
+
+
+def parse_wav_header(f):
+    # Walks the RIFF chunks and returns (sample_rate, channels, bits,
+    # format_tag, data_offset, data_size) without reading any PCM data.
+    riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+    if riff != b'RIFF' or wave != b'WAVE':
+        raise ValueError('not a RIFF/WAVE file')
+    fmt = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            raise ValueError('no data chunk')
+        chunk_id, size = struct.unpack('<4sI', header)
+        if chunk_id == b'fmt ':
+            body = f.read(size)
+            format_tag, channels, sample_rate = struct.unpack('<HHI', body[:8])
+            bits = struct.unpack('<H', body[14:16])[0]
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+                if body[24:26] == PCM_SUBFORMAT_PREFIX:
+                    format_tag = WAVE_FORMAT_PCM
+            fmt = (sample_rate, channels, bits, format_tag)
+            if size % 2:
+                f.seek(1, os.SEEK_CUR)
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise ValueError('data chunk before fmt chunk')
+            return (*fmt, f.tell(), size)
+        else:
+            f.seek(size + size % 2, os.SEEK_CUR)
+
+
+class WavMemmap:
+    # Read-only view of a WAV file's samples as an int16 (frames, channels)
+    # array. 16-bit PCM files are memory-mapped, so slices are views into the
+    # page cache and can be handed to any number of threads without copying;
+    # anything else is decoded once to int16 through soundfile.
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                sr, channels, bits, format_tag, offset, size = parse_wav_header(f)
+            except (ValueError, struct.error):
+                format_tag = None
+        if format_tag == WAVE_FORMAT_PCM and bits == 16:
+            frame_bytes = 2 * channels
+            size = min(size, os.path.getsize(path) - offset)
+            frames = size // frame_bytes
+            self.sample_rate = sr
+            self.data = np.memmap(
+                path, dtype='<i2', mode='r', offset=offset, shape=(frames, channels)
+            ) if frames else np.zeros((0, channels), dtype='<i2')
+        else:
+            self.data, self.sample_rate = sf.read(path, dtype='int16', always_2d=True)
+
+    @property
+    def frames(self):
+        return self.data.shape[0]
+
+    @property
+    def channels(self):
+        return self.data.shape[1]
+
+    def read(self, start, end):
+        return self.data[start:end]
+
+    def frame_range(self, start_s, end_s):
+        start = min(max(int(start_s * self.sample_rate), 0), self.frames)
+        end = min(max(int(end_s * self.sample_rate), start), self.frames)
+        return start, end
+
+    def slice(self, start_s, end_s):
+        start, end = self.frame_range(start_s, end_s)
+        view = self.data[start:end]
+        return view[:, 0] if self.channels == 1 else view
@@ -0,0 +1,40 @@
+import os
+import sys
+import json
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'dataset_processing_scripts'))
+
+import atcc_text
+import atco2_text
+import uwb_text
+
+GOLDEN_DIR = os.path.join(ROOT, 'benchmarks', 'data')
+# Golden corpus -> the normalizer its outputs were recorded from.
+NORMALIZERS = {
+    'uwb_convert_atc_text_golden.jsonl': uwb_text.convert_atc_text,
+    'uwb_normalize_transmission_golden.jsonl': lambda raw: uwb_text.normalize_transmission(raw)[0],
+    'atcc_normalize_transmission_golden.jsonl': lambda raw: atcc_text.normalize_transmission(raw)[0],
+    'atco2_normalize_transmission_golden.jsonl': lambda raw: atco2_text.normalize_transmission(raw)[0],
+}
+
+
+def test_every_golden_corpus_is_replayed():
+    assert sorted(f for f in os.listdir(GOLDEN_DIR) if f.endswith('.jsonl')) == sorted(NORMALIZERS)
+
+
+@pytest.mark.parametrize('name', sorted(NORMALIZERS))
+def test_golden_corpus(name, tmp_path, monkeypatch):
+    # Normalizers may build artifacts under the working directory.
+    monkeypatch.chdir(tmp_path)
+    normalize = NORMALIZERS[name]
+    with open(os.path.join(GOLDEN_DIR, name), encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    mismatches = [
+        (r['input'], r['output'], got)
+        for r in records
+        if (got := normalize(r['input'])) != r['output']
+    ]
+    assert mismatches == []
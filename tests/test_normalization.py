@@ -0,0 +1,25 @@
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dataset_processing_scripts'))
+
+from normalization import CorrectionEngine
+
+
+def per_key_sub(corrections, text):
+    for wrong, right in corrections.items():
+        text = re.sub(rf'\b{re.escape(wrong)}\b', right, text, flags=re.IGNORECASE)
+    return text
+
+
+def test_correction_engine_handles_non_ascii_case_folds():
+    # The Kelvin sign folds to k and dotted capital I to i under IGNORECASE,
+    # though neither upper-cases to the table key.
+    cases = [
+        ({'OK': 'OKAY'}, 'roger OK'),
+        ({'hi': 'HELLO'}, 'Hİ tower'),
+        ({'i': 'EYE', 'OK': 'OKAY'}, 'İ said oK'),
+    ]
+    for corrections, text in cases:
+        assert CorrectionEngine(corrections)(text) == per_key_sub(corrections, text)
@@ -0,0 +1,51 @@
+import os
+import sys
+import tarfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dataset_processing_scripts'))
+
+from output_sink import DirectorySink, TarShardSink, iter_samples
+
+
+def test_tar_resume_drops_samples_of_unjournaled_sources(tmp_path):
+    root = str(tmp_path)
+    sink = TarShardSink(root)
+    sink.write('A1', text='a one', audio_bytes=b'wav-a1')
+    sink.write('B1', text='b one', audio_bytes=b'wav-b1')
+    sink.write('A2', text='a two', audio_bytes=b'wav-a2')
+    sink.flush()
+    # Killed here, with only source A journaled; B is re-run on resume.
+    sink = TarShardSink(root, resume=True)
+    sink.restore([{'id': 'A1'}, {'id': 'A2'}])
+    sink.write('B1', text='b one', audio_bytes=b'wav-b1')
+    sink.close()
+
+    samples = {s.uid: (s.text, s.audio_bytes) for s in iter_samples(root)}
+    assert len(list(iter_samples(root))) == 3
+    assert samples == {
+        'A1': ('a one\n', b'wav-a1'),
+        'A2': ('a two\n', b'wav-a2'),
+        'B1': ('b one\n', b'wav-b1'),
+    }
+    members = []
+    for f in sorted(os.listdir(root)):
+        if f.endswith('.tar'):
+            with tarfile.open(os.path.join(root, f)) as tar:
+                members.extend(tar.getnames())
+    assert sorted(members) == ['A1.txt', 'A1.wav', 'A2.txt', 'A2.wav', 'B1.txt', 'B1.wav']
+
+
+def test_sinks_end_every_text_with_one_newline(tmp_path):
+    texts = {'bare': 'roger', 'one': 'roger\n', 'two': 'roger\n\n'}
+    tar_root = str(tmp_path / 'tar')
+    tar_sink = TarShardSink(tar_root)
+    dir_sink = DirectorySink(str(tmp_path / 'dir'))
+    for uid, text in texts.items():
+        tar_sink.write(uid, text=text, audio_bytes=b'wav')
+        dir_sink.write(uid, text=text, audio_bytes=b'wav')
+    tar_sink.close()
+
+    assert {s.uid: s.text for s in iter_samples(tar_root)} == dict.fromkeys(texts, 'roger\n')
+    for uid in texts:
+        with open(tmp_path / 'dir' / 'texts' / f'{uid}.txt', encoding='utf-8') as f:
+            assert f.read() == 'roger\n'
@@ -1,9 +1,16 @@
+import sys
 import random
-import shutil
+import argparse
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'dataset_processing_scripts'))
+
+from executors import DEFAULT_WORKERS
+from materialize import MANIFEST_NAME, MATERIALIZE_MODES, read_manifest, write_manifest
+from output_sink import Sample, add_sink_arguments, is_sharded, is_virtual, iter_samples, list_ids, open_sink
+from pipeline import Pipeline, Stage, add_pipeline_arguments, stage_workers
+
 RANDOM_SEED = 42
 random.seed(RANDOM_SEED)
 
@@ -11,15 +18,35 @@ SOURCE_DIR = Path('ATC_ASR_Dataset')
 OUTPUT_DIR = Path('ATC_ASR_Dataset_Splits')
 TRAIN_RATIO = 0.8
 VAL_RATIO = 0.1
+DEFAULT_MATERIALIZE = 'reflink'
 
-AUDIO_DIR = SOURCE_DIR / 'audios'
 TEXT_DIR = SOURCE_DIR / 'texts'
+SOURCE_MANIFEST = SOURCE_DIR / MANIFEST_NAME
 
-uuids = [
-    f.stem
-    for f in AUDIO_DIR.glob('*.wav')
-    if (TEXT_DIR / f.with_suffix('.txt').name).exists()
-]
+parser = argparse.ArgumentParser(description='Split ATC_ASR_Dataset into train, validation and test.')
+parser.add_argument('--materialize', choices=MATERIALIZE_MODES, default=DEFAULT_MATERIALIZE,
+                    help='How audio and transcript files are placed in the split folders.')
+parser.add_argument('--manifest-only', action='store_true',
+                    help=f'Write only a {MANIFEST_NAME} per split, pointing at the source clips.')
+add_sink_arguments(parser)
+add_pipeline_arguments(parser)
+args = parser.parse_args()
+
+# A manifest-only combine leaves no texts/ folder; its manifest is the source.
+FROM_MANIFEST = (SOURCE_MANIFEST.exists() and not TEXT_DIR.is_dir()
+                 and not is_sharded(SOURCE_DIR) and not is_virtual(SOURCE_DIR))
+if FROM_MANIFEST:
+    manifest = read_manifest(SOURCE_MANIFEST)
+    uuids = [r['id'] for r in manifest]
+else:
+    uuids = list_ids(SOURCE_DIR)
+if args.manifest_only and (is_sharded(SOURCE_DIR) or is_virtual(SOURCE_DIR)):
+    parser.error('--manifest-only needs a directory or manifest source, not tar shards or segments')
+if args.manifest_only and args.output_format != 'dir':
+    parser.error('--manifest-only cannot be combined with --output-format tar')
+# IDs are content-addressed, so sorting first makes the split reproducible
+# across reruns and filesystems.
+uuids.sort()
 random.shuffle(uuids)
 
 total = len(uuids)
@@ -31,20 +58,58 @@ splits = {
     'validation': uuids[train_end:val_end],
     'test': uuids[val_end:],
 }
+split_of = {uid: split for split, lst in splits.items() for uid in lst}
+
+def iter_source():
+    if FROM_MANIFEST:
+        for r in manifest:
+            yield Sample(r['id'], r['text'], None, r['audio'], None)
+    else:
+        yield from iter_samples(SOURCE_DIR)
+
+def manifest_record(sample):
+    if sample.text is not None:
+        text = sample.text
+    else:
+        text = Path(sample.text_path).read_text(encoding='utf-8')
+    return {'id': sample.uid, 'audio': str(Path(sample.audio_path).resolve()), 'text': text.strip()}
+
+def copy_entry(sample):
+    sink = sinks[split_of[sample.uid]]
+    if sink.claim(sample.uid):
+        sink.write(sample.uid, text=sample.text, text_path=sample.text_path,
+                   audio_path=sample.audio_path, audio_bytes=sample.audio_bytes)
+    return sample.uid
+
+if args.manifest_only:
+    records = {split: [] for split in splits}
+    for sample in iter_source():
+        records[split_of[sample.uid]].append(manifest_record(sample))
+    for split, lst in records.items():
+        (OUTPUT_DIR / split).mkdir(parents=True, exist_ok=True)
+        write_manifest(OUTPUT_DIR / split / MANIFEST_NAME, lst)
+        print(f'{split}: {len(lst)} entries')
+else:
+    sinks = {
+        split: open_sink(OUTPUT_DIR / split, args.output_format, args.materialize, args.shard_size_mb << 20,
+                         prune=args.prune)
+        for split in splits
+    }
+    for split in splits:
+        (OUTPUT_DIR / split / MANIFEST_NAME).unlink(missing_ok=True)
+    # Samples from tar shards are held in memory; the pipeline's bounded
+    # queue keeps only a fixed number of them alive at once.
+    progress = tqdm(total=total, desc='Splitting Dataset')
+    pipeline = Pipeline(
+        [
+            Stage('copy', copy_entry, stage_workers(args, 'copy', DEFAULT_WORKERS)),
+            Stage('progress', lambda _: progress.update()),
+        ],
+        args.queue_size,
+    )
+    pipeline.run(iter_source())
+    progress.close()
+    for sink in sinks.values():
+        sink.close()
 
-def copy_entry(uid, split_name):
-    (OUTPUT_DIR / split_name / 'audios').mkdir(parents=True, exist_ok=True)
-    (OUTPUT_DIR / split_name / 'texts').mkdir(parents=True, exist_ok=True)
-    shutil.copy2(AUDIO_DIR / f'{uid}.wav', OUTPUT_DIR / split_name / 'audios' / f'{uid}.wav')
-    shutil.copy2(TEXT_DIR / f'{uid}.txt', OUTPUT_DIR / split_name / 'texts' / f'{uid}.txt')
-
-with ThreadPoolExecutor() as ex:
-    futures = [
-        ex.submit(copy_entry, uid, split)
-        for split, lst in splits.items()
-        for uid in lst
-    ]
-    for _ in tqdm(as_completed(futures), total=len(futures), desc='Splitting Dataset'):
-        pass
-
-print('Dataset split completed.')
\ No newline at end of file
+print('Dataset split completed.')
@@ -1,7 +1,17 @@
 import os
+import json
 from datasets import Dataset, DatasetDict, Audio
 
 def load_split_data(split_folder):
+    manifest_path = os.path.join(split_folder, "manifest.jsonl")
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        return Dataset.from_dict({
+            "id": [r["id"] for r in records],
+            "audio": [r["audio"] for r in records],
+            "text": [r["text"] for r in records],
+        }).cast_column("audio", Audio())
     transcripts_folder = os.path.join(split_folder, "texts")
     audios_folder = os.path.join(split_folder, "audios")
     ids, audio_paths, texts = [], [], []